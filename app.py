@@ -1,71 +1,157 @@
-from summarizer import summarize
-from llm import llm
+from summarizer import prepare, summarize_prepared, get_prompt_stats
+from preprocess import ProcessPool
+from llm import llm, get_stream_stats, get_validation_stats, job_priority
+from workers import WorkerPool
+from rpc import RpcPool
+import scheduler
+import summary_cache
+import body_cache
+import http_cache
+import metrics
 import database
 import settings
-from sqlalchemy import and_, or_, not_
-from threading import Event
+from sections import SectionRegistry
 import datetime
 import subprocess
 import re
 import time
-import queue
 import os
 import requests
 import json
 from bs4 import BeautifulSoup
 from flask_socketio import SocketIO, emit
 from flask_cors import CORS
-from flask import Flask, request, jsonify, after_this_request, render_template
+from flask import Flask, Response, request, jsonify, after_this_request, render_template
 import eventlet
+import eventlet.semaphore
 eventlet.monkey_patch()
 
 
-task_queue = queue.PriorityQueue()
-queue_counter = 0
+INTERACTIVE_PRIORITY = 1000000
+JOB_POLL_INTERVAL = 5
+# Most messages one listing or search request may ask for
+MAX_PAGE_SIZE = 100
+EMPTY_COUNTS = {'total': 0, 'unread': 0, 'flagged': 0}
 
 
 def enqueue_task(priority, message_id):
-    global queue_counter
-    print(f"+{queue_counter}: priority = {priority}, header_message_id = {message_id}")
-    task_queue.put((priority, queue_counter, message_id))
-    queue_counter += 1
+    print(f"+: priority = {priority}, header_message_id = {message_id}")
+    database.SummaryJob.enqueue(message_id, priority)
+    worker_pool.notify()
 
 
 def process_task(priority, queue_idx, message_id):
-    email, reason = get_full_email(message_id)
+    with metrics.timed('body_fetch'):
+        email, reason = get_full_email(message_id)
     if not email:
         print(f"{queue_idx}: Failed to obtain full mail, {reason}")
-        return
-    summary_data, reason = summarize(email)
+        return False, f"Failed to obtain full mail, {reason}"
+    # Fetch the next bodies from Thunderbird while this one is summarized
+    eventlet.spawn_n(prefetch_bodies)
+    with metrics.timed('preprocess'):
+        if preprocess_pool:
+            prepared, reason = preprocess_pool.call(email)
+        else:
+            prepared, reason = prepare(email), "Success"
+    if not prepared:
+        print(f"{queue_idx}: Failed to preprocess, {reason}")
+        return False, f"Failed to preprocess, {reason}"
+    # Generation slots are limited, jobs prepared ahead wait here for the next free
+    # slot, which goes to the most urgent of them
+    with job_priority(priority):
+        summary_data, reason = summarize_prepared(prepared)
     if not summary_data:
         print(f"{queue_idx}: Failed to summarize, {reason}")
-        return
+        return False, f"Failed to summarize, {reason}"
     message_summary = database.MessageSummary.from_data(
         summary_data, email['header']['id'])
-    status, message, obj = message_summary.add_to_db()
+    with metrics.timed('db_write'):
+        status, message, obj = message_summary.add_to_db()
     if not status:
         print(f"{queue_idx}: Failed to add summary to database: {message}")
-        return
+        return False, f"Failed to add summary to database: {message}"
     print(f"{queue_idx}: Added summary to database successfully")
+    push_summary_ready(obj)
+    return True, "Success"
+
+
+interactive_streak = 0
+
+
+def claim_task():
+    """Claim the next job, letting a background job through after every
+    `INTERACTIVE_SHARE` interactive ones so neither class starves."""
+    global interactive_streak
+    interactive_first = interactive_streak < settings.INTERACTIVE_SHARE
+    for interactive in (interactive_first, not interactive_first):
+        if interactive:
+            job = database.SummaryJob.claim_next(
+                settings.JOB_PRIORITY_AGING_PER_HOUR, min_priority=INTERACTIVE_PRIORITY)
+        else:
+            job = database.SummaryJob.claim_next(
+                settings.JOB_PRIORITY_AGING_PER_HOUR, below_priority=INTERACTIVE_PRIORITY)
+        if job:
+            interactive_streak = interactive_streak + 1 if interactive else 0
+            return job.id
+    return None
+
+
+def handle_task(job_id):
+    with app.app_context():
+        job = database.db.session.get(database.SummaryJob, job_id)
+        with metrics.job_trace(job.id, job.header_message_id, job.attempts) as trace:
+            metrics.record_stage('queue_wait', max(time.time() - max(job.enqueued_at, job.available_at), 0))
+            try:
+                status, reason = process_task(
+                    job.priority, job.id, job.header_message_id)
+            except Exception as e:
+                database.db.session.rollback()
+                status, reason = False, f"Unexpected error: {e}"
+            if status:
+                trace.outcome = 'success'
+                job.complete()
+            else:
+                trace.outcome = 'failed'
+                trace.fields['reason'] = reason
+                job.fail(reason, settings.JOB_MAX_ATTEMPTS,
+                         settings.JOB_RETRY_DELAY)
 
 
 def process_tasks():
     with app.app_context():
-        while True:
-            priority, queue_idx, message_id = task_queue.get()
-            process_task(priority, queue_idx, message_id)
+        pending = database.SummaryJob.recover()
+        print(f"Recovered {pending} pending summarization jobs")
+        worker_pool.run()
+
 
+preprocess_pool = (ProcessPool(settings.PREPROCESS_PROCESSES, 'summarizer:prepare')
+                   if settings.PREPROCESS_PROCESSES else None)
+worker_pool = WorkerPool(settings.OLLAMA_PARALLELISM + settings.PREPROCESS_AHEAD,
+                         claim_task, handle_task, poll_interval=JOB_POLL_INTERVAL)
+prefetch_lock = eventlet.semaphore.Semaphore(1)
 
 app = Flask(__name__, static_folder='static', template_folder='templates')
 CORS(app, origins="*", supports_credentials=True)
 socketio = SocketIO(app, cors_allowed_origins="*")
 database.init_app(app)
+section_registry = SectionRegistry(settings.SECTIONS, settings.TABS)
+with app.app_context():
+    section_registry.sync()
 
 eventlet.spawn(process_tasks)
 
 # Webpages
 
 
+@app.url_defaults
+def version_static_urls(endpoint, values):
+    # A changed file gets a new URL, so the old one may be cached for good
+    if endpoint == 'static' and 'filename' in values:
+        version = http_cache.static_version(app.static_folder, values['filename'])
+        if version:
+            values['v'] = version
+
+
 @app.route('/')
 def index():
     return render_template('mailbox.html')
@@ -75,6 +161,8 @@ def index():
 
 thunderbird_clients = set()
 frontend_clients = set()
+# Frontend sid -> names of the sections it shows, live updates are limited to those
+frontend_subscriptions = {}
 
 
 def serialize_datetime(obj):
@@ -91,46 +179,37 @@ def serialize_datetime(obj):
     return obj
 
 
-def message(clients, event, message):
+def send(clients, event, message):
+    # socketio.emit works outside of socket handlers too, e.g. from routes and workers
     serialized_message = serialize_datetime(message)
-    for sid in clients:
-        emit(event, serialized_message, room=sid, namespace='/')
+    for sid in list(clients):
+        socketio.emit(event, serialized_message, to=sid, namespace='/')
 
 
 def thunderbridge(event, message):
-    message(thunderbird_clients, event, message)
+    send(thunderbird_clients, event, message)
 
 
 def frontend(event, message):
-    message(frontend_clients, event, message)
+    send(frontend_clients, event, message)
 
 
-def message_sync(clients, event, message):
-    if not clients:
-        return None, "No thunderbridge clients connected"
-    response_data = {}
-    response_received = Event()
+def emit_with_callback(event, message, sid, callback):
+    socketio.emit(event, serialize_datetime(message), to=sid, namespace='/', callback=callback)
 
-    def handle_client_response(data):
-        response_data['value'] = data
-        response_received.set()
 
-    serialized_message = serialize_datetime(message)
-    for sid in clients:
-        emit(event, serialized_message, room=sid,
-             namespace='/', callback=handle_client_response)
-    response_received.wait(timeout=10)
-    if 'value' in response_data:
-        return response_data['value'], "Success"
-    return None, "All thunderbridge clients didn't return any data"
+thunderbridge_rpc = RpcPool(emit_with_callback, max_in_flight=settings.RPC_MAX_IN_FLIGHT,
+                            timeout=settings.RPC_TIMEOUT)
+frontend_rpc = RpcPool(emit_with_callback, max_in_flight=settings.RPC_MAX_IN_FLIGHT,
+                       timeout=settings.RPC_TIMEOUT)
 
 
-def thunderbridge_sync(event, message):
-    return message_sync(thunderbird_clients, event, message)
+def thunderbridge_sync(event, message, timeout=None):
+    return thunderbridge_rpc.call(event, message, timeout)
 
 
-def frontend_sync(event, message):
-    return message_sync(frontend_clients, event, message)
+def frontend_sync(event, message, timeout=None):
+    return frontend_rpc.call(event, message, timeout)
 
 
 @socketio.on('connect')
@@ -140,36 +219,146 @@ def handle_connect():
 
 @socketio.on('disconnect')
 def handle_disconnect():
-    if request.sid in thunderbird_clients:
-        thunderbird_clients.remove(request.sid)
-        frontend_clients.remove(request.sid)
+    thunderbird_clients.discard(request.sid)
+    frontend_clients.discard(request.sid)
+    thunderbridge_rpc.remove(request.sid)
+    frontend_rpc.remove(request.sid)
+    frontend_subscriptions.pop(request.sid, None)
+    scheduler.forget(request.sid, subscribed_sections())
     print()
     print(f'Client {request.sid} disconnected!')
 
 
+def sync_state():
+    """What thunderbridge needs to only send messages newer than the last completed sync."""
+    return {
+        'checkpoints': database.SyncCheckpoint.for_sync(),
+        'overlap_seconds': settings.SYNC_OVERLAP_SECONDS,
+    }
+
+
+@socketio.on('folder-synced')
+def handle_folder_synced(data):
+    folder = data.get('folder') if isinstance(data, dict) else None
+    latest_date = data.get('latest_date') if isinstance(data, dict) else None
+    if (not isinstance(folder, dict) or not isinstance(folder.get('accountId'), str)
+            or not isinstance(folder.get('path'), str)
+            or not (latest_date is None or isinstance(latest_date, (int, float)))):
+        print(f"Ignoring malformed folder-synced payload: {data}")
+        return
+    database.SyncCheckpoint.advance(folder, latest_date)
+
+
 @socketio.on('thunderbridge-hello')
 def handle_thunderbridge_hello(message):
     print(f'Thunderbridge {request.sid} connected')
     thunderbird_clients.add(request.sid)
-    emit('fetch-emails', {})
+    thunderbridge_rpc.add(request.sid)
+    emit('fetch-emails', sync_state())
 
 
 @socketio.on('frontend-hello')
 def handle_frontend_hello(message):
     print(f'Frontend {request.sid} connected')
-    thunderbird_clients.add(request.sid)
-    emit('fetch-emails', {})
+    frontend_clients.add(request.sid)
+    frontend_rpc.add(request.sid)
+    thunderbridge('fetch-emails', sync_state())
+
+
+@socketio.on('subscribe')
+def handle_subscribe(data):
+    tab_sections = section_registry.tab_sections(data.get('tab'))
+    if tab_sections is None:
+        return {'error': 'Tab not found'}
+    wanted = set(data.get('sections') or [])
+    frontend_subscriptions[request.sid] = {
+        section.name for section in tab_sections if not wanted or section.name in wanted}
+    return {'status': 'subscribed', 'sections': sorted(frontend_subscriptions[request.sid])}
+
+
+@socketio.on('viewport')
+def handle_viewport(data):
+    visible = [header_message_id for header_message_id in data.get('visible', [])
+               if isinstance(header_message_id, str)]
+    if scheduler.update_viewport(request.sid, visible, INTERACTIVE_PRIORITY, subscribed_sections()):
+        worker_pool.notify()
+
+
+def subscribed_sections():
+    return set().union(*frontend_subscriptions.values())
+
+
+def card_dict(message):
+    """The fields of a message the mailbox cards show."""
+    return {
+        'header_message_id': message.header_message_id,
+        'date': message.date,
+        'subject': message.subject,
+        'author_name': message.author_name,
+        'author_email': message.author_email,
+        'summary': message.summary.to_dict(json_ready=True) if message.summary else None,
+    }
+
+
+def push_messages_ingested(header_message_ids):
+    """Send new or changed messages to the frontends showing their sections."""
+    sections = subscribed_sections()
+    if not sections or not header_message_ids:
+        return
+    messages = (database.db.session.query(database.Message)
+                .options(*database.Message.listing_options())
+                .filter(database.Message.header_message_id.in_(header_message_ids))
+                .all())
+    membership = database.sections_of((message.id for message in messages), sections)
+    by_section = {}
+    for message in sorted(messages, key=lambda message: (message.date, message.id), reverse=True):
+        for section in membership.get(message.id, []):
+            by_section.setdefault(section, []).append(card_dict(message))
+    for sid, subscription in list(frontend_subscriptions.items()):
+        for section in subscription & by_section.keys():
+            socketio.emit('messages-ingested', {'section': section, 'emails': by_section[section]},
+                          to=sid, namespace='/')
+
+
+def push_summary_ready(summary):
+    """Send a new summary to the frontends showing a section of its message."""
+    sections = subscribed_sections()
+    if not sections:
+        return
+    message_sections = set(database.sections_of([summary.message_id], sections).get(summary.message_id, []))
+    if not message_sections:
+        return
+    payload = {
+        'header_message_id': summary.message.header_message_id,
+        'summary': summary.to_dict(json_ready=True),
+    }
+    for sid, subscription in list(frontend_subscriptions.items()):
+        if subscription & message_sections:
+            socketio.emit('summary-ready', dict(payload, sections=sorted(subscription & message_sections)),
+                          to=sid, namespace='/')
 
 # APIs
 
 
+@app.before_request
+def start_request_metrics():
+    metrics.begin_request()
+
+
 @app.after_request
 def add_header(response):
-    response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0, max-age=0'
-    response.headers['Pragma'] = 'no-cache'
-    response.headers['Expires'] = '-1'
+    if request.endpoint == 'static':
+        http_cache.cache_static(response, app.static_folder)
+    elif 'Cache-Control' not in response.headers:
+        # Only responses of http_cache.conditional views may be reused
+        response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0, max-age=0'
+        response.headers['Pragma'] = 'no-cache'
+        response.headers['Expires'] = '-1'
+    http_cache.compress(response)
     if response.status_code == 403:
         print(f"CORS issue detected: {request.url}")
+    metrics.end_request(request.method, request.url_rule.rule if request.url_rule else 'unmatched',
+                        response.status_code)
     return response
 
 
@@ -180,21 +369,31 @@ def add_messages():
     if not data or 'messages' not in data:
         return jsonify({"status": "error", "message": "Expected a 'messages' key in the request data."}), 400
 
-    results = []
-    for message_data in data['messages']:
-        status, message, obj = database.Message.create_and_add_to_db(
-            message_data)
-        results.append({"status": status, "message": message})
-
-    if all(result["status"] for result in results):
+    results, changed = database.Message.bulk_create_and_add_to_db(data['messages'])
+    # Thunderbridge logs failed messages by their id
+    results = [{"status": status, "message": message,
+                "headerMessageId": message_data.get('headerMessageId') if isinstance(message_data, dict) else None}
+               for (status, message), message_data in zip(results, data['messages'])]
+    header_message_ids = [message['headerMessageId'] for message in data['messages']
+                          if isinstance(message, dict) and message.get('headerMessageId')]
+    if changed:
+        push_section_counts()
+        push_messages_ingested(changed)
+    if scheduler.enqueue_ingested(header_message_ids, subscribed_sections()):
+        worker_pool.notify()
+
+    failed_messages = [result for result in results if not result["status"]]
+    if changed is None:
+        # Nothing of the page was stored, the sender has to try again
+        return jsonify({"status": "error", "message": "The messages could not be stored.", "details": failed_messages}), 500
+    if not failed_messages:
         return jsonify({"status": "success", "message": "Messages processed successfully.", "details": results}), 200
-    else:
-        failed_messages = [
-            result for result in results if not result["status"]]
-        return jsonify({"status": "error", "message": "Some messages could not be processed.", "details": failed_messages}), 400
+    # The valid messages were stored, only the listed ones were rejected
+    return jsonify({"status": "error", "message": "Some messages could not be processed.", "details": failed_messages}), 400
 
 
 @app.route('/api/tabs', methods=['GET'])
+@http_cache.conditional(depends_on_data=False)
 def get_tabs():
     tab_names = [tab['name'] for tab in settings.TABS]
     tabs = []
@@ -212,152 +411,84 @@ def get_tabs():
 
 
 @app.route('/api/tabs/<tab>/sections', methods=['GET'])
+@http_cache.conditional(depends_on_data=False)
 def get_tab_sections(tab):
-    def get_filter_description(section_config, prefix=''):
-        filter_descriptions = []
-        and_filters = section_config.get('and', [])
-        or_filters = section_config.get('or', [])
-        not_filters = section_config.get('exclude', [])
-        simple_filters = section_config.get('filters', [])
-
-        if and_filters:
-            for i, and_filter in enumerate(and_filters, start=1):
-                nested_section = next(
-                    (sect for sect in settings.SECTIONS if sect['name'] == and_filter), None)
-                and_prefix = f'{prefix}AND[{i}] ' if len(
-                    and_filters) > 1 else prefix
-                filter_descriptions.extend(
-                    get_filter_description(nested_section, and_prefix))
-
-        if or_filters:
-            for i, or_filter in enumerate(or_filters, start=1):
-                nested_section = next(
-                    (sect for sect in settings.SECTIONS if sect['name'] == or_filter), None)
-                or_prefix = f'{prefix}OR[{i}] ' if len(
-                    or_filters) > 1 else prefix
-                filter_descriptions.extend(
-                    get_filter_description(nested_section, or_prefix))
-
-        if not_filters:
-            for i, not_filter in enumerate(not_filters, start=1):
-                nested_section = next(
-                    (sect for sect in settings.SECTIONS if sect['name'] == not_filter), None)
-                not_prefix = f'{prefix}NOT[{i}] '
-                filter_descriptions.extend(
-                    get_filter_description(nested_section, not_prefix))
-
-        and_prefix = 'AND' if len(simple_filters) > 1 else ''
-        for i, simple_filter in enumerate(simple_filters, start=1):
-            # Format the simple filter string here
-            filter_str = f'{prefix}{and_prefix}[{i}] {simple_filter["type"]}: {simple_filter["value"]}' if and_prefix else f'{prefix}{simple_filter["type"]}: {simple_filter["value"]}'
-            filter_descriptions.append(filter_str)
-
-        return filter_descriptions
-
-    tab_config = next(
-        (item for item in settings.TABS if item['name'] == tab), None)
-    if not tab_config:
+    tab_sections = section_registry.tab_sections(tab)
+    if tab_sections is None:
         return jsonify({'error': 'Tab not found'}), 404
-    section_names = tab_config.get('sections', [])
-    sections = []
-    for section_name in section_names:
-        section_config = next(
-            (sect for sect in settings.SECTIONS if sect['name'] == section_name), None)
-        if not section_config:
-            return jsonify({'error': 'Section not found'}), 404
-        section_details = {
-            'name': section_name,
-            'display_name': section_config.get('display_name', section_name),
-            'filters': get_filter_description(section_config),
-        }
-        sections.append(section_details)
-    return jsonify(sections)
+    return jsonify([section.to_dict() for section in tab_sections])
+
+
+@app.route('/api/tabs/<tab>/counts', methods=['GET'])
+@http_cache.conditional()
+def get_tab_counts(tab):
+    tab_sections = section_registry.tab_sections(tab)
+    if tab_sections is None:
+        return jsonify({'error': 'Tab not found'}), 404
+    counts = database.section_counts()
+    return jsonify({section.name: counts.get(section.name, EMPTY_COUNTS) for section in tab_sections})
+
+
+# Counters as last pushed to frontends, to send only the sections that changed
+pushed_counts = {}
+
+
+def push_section_counts():
+    counts = database.section_counts()
+    changed = {name: value for name, value in counts.items() if pushed_counts.get(name) != value}
+    if changed:
+        pushed_counts.update(changed)
+        frontend('section-counts', changed)
 
 
 @app.route('/api/tabs/<tab>/sections/<section>/emails', methods=['GET'])
+@http_cache.conditional()
 def get_emails_by_section(tab, section):
-    def get_filters_for_section(section_name):
-        section_config = next(
-            (sect for sect in settings.SECTIONS if sect['name'] == section_name), None)
-        if not section_config:
-            raise ValueError(f'Section {section_name} not found')
-
-        query_filters = []
-
-        if 'and' in section_config:
-            and_filters = [get_filters_for_section(
-                name) for name in section_config['and']]
-            query_filters.extend([and_(*section_filters)
-                                 for section_filters in and_filters])
-
-        for filter_def in section_config.get('filters', []):
-            if filter_def['type'] == 'sender_domain':
-                query_filters.append(database.Message.author_email.ilike(
-                    f"%@{filter_def['value']}"))
-            elif filter_def['type'] == 'sender_email':
-                query_filters.append(
-                    database.Message.author_email == filter_def['value'])
-            elif filter_def['type'] == 'subject_contains':
-                query_filters.append(database.Message.subject.ilike(
-                    f"%{filter_def['value']}%"))
-            elif filter_def['type'] == 'sender_name_contains':
-                query_filters.append(database.Message.author_name.ilike(
-                    f"%{filter_def['value']}%"))
-
-        # Handle 'or' logic
-        if 'or' in section_config:
-            or_filters = [get_filters_for_section(
-                name) for name in section_config['or']]
-            query_filters.append(
-                or_(*[and_(*section_filters) for section_filters in or_filters]))
-
-        # Handle 'exclude' logic
-        if 'exclude' in section_config:
-            exclude_filters = [get_filters_for_section(
-                name) for name in section_config['exclude']]
-            # Here we need to negate the combined exclude filters
-            for exclude_filter in exclude_filters:
-                query_filters.append(~and_(*exclude_filter))
-
-        return query_filters
-
-    # Get 'start_from' as a Unix timestamp; default to None if not provided
-    start_from = request.args.get('start_from', default=None, type=int)
+    # Opaque cursor from the previous page's 'next_cursor'; first page if not provided
+    cursor = request.args.get('cursor', default=None, type=str)
     limit = request.args.get('limit', default=10, type=int)
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        return jsonify({'error': f"Parameter 'limit' must be between 1 and {MAX_PAGE_SIZE}"}), 400
 
     # Find the tab configuration
-    tab_config = next(
-        (item for item in settings.TABS if item['name'] == tab), None)
-    if not tab_config:
+    tab_sections = section_registry.tab_sections(tab)
+    if tab_sections is None:
         return jsonify({'error': 'Tab not found'}), 404
 
     # Check if the section exists in the tab configuration
-    if section not in tab_config.get('sections', []):
+    compiled_section = next(
+        (item for item in tab_sections if item.name == section), None)
+    if not compiled_section:
         return jsonify({'error': 'Section not found in tab'}), 404
 
-    # Find the section configuration
-    section_config = next(
-        (sect for sect in settings.SECTIONS if sect['name'] == section), None)
-    if not section_config:
-        return jsonify({'error': 'Section not found'}), 404
-
-    # Construct filters for query based on the section configuration
-    query_filters = get_filters_for_section(section)
-
-    # Add start_from to the filters if it's provided
-    if start_from:
-        query_filters.append(database.Message.date <= start_from)
-
-    # Query the database with all the constructed filters and order by date
-    messages_query = (database.db.session.query(database.Message)
-                      .filter(and_(*query_filters))
-                      .order_by(database.Message.date.desc())
-                      .limit(limit))
-
-    # Convert the messages to dicts and return JSON
-    messages_list = [message.to_dict(relationships=True)
-                     for message in messages_query.all()]
-    return jsonify(messages_list)
+    cursor_position = None
+    if cursor:
+        cursor_position = database.Message.decode_cursor(cursor)
+        if cursor_position is None:
+            return jsonify({'error': 'Invalid cursor'}), 400
+
+    messages_list, next_cursor = compiled_section.page(limit, cursor_position)
+    return jsonify({'emails': messages_list, 'next_cursor': next_cursor})
+
+
+@app.route('/api/search', methods=['GET'])
+@http_cache.conditional()
+def search():
+    query = request.args.get('q', default='', type=str).strip()
+    limit = request.args.get('limit', default=20, type=int)
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        return jsonify({'error': f"Parameter 'limit' must be between 1 and {MAX_PAGE_SIZE}"}), 400
+    if not database.search_index_available:
+        return jsonify({'error': 'Full-text search is not available in this SQLite build'}), 503
+    # The trigram index needs at least three characters to match on
+    if len(query) < 3:
+        return jsonify({'error': "Parameter 'q' needs at least 3 characters"}), 400
+    results = []
+    for message, rank in database.search_messages(query, limit):
+        message_dict = message.to_dict(relationships=True, json_ready=True)
+        message_dict['rank'] = rank
+        results.append(message_dict)
+    return jsonify({'emails': results})
 
 
 @app.route('/api/enqueue-summary', methods=['POST'])
@@ -365,26 +496,37 @@ def enqueue_summary():
     data = request.json
     if not data or not data.get('header_message_id'):
         return jsonify({"error": "Field 'header_message_id' is required and missing."}), 400
-    enqueue_task(1000000, data['header_message_id'])
+    enqueue_task(INTERACTIVE_PRIORITY, data['header_message_id'])
     return jsonify({"status": "Task enqueued successfully"}), 200
 
 
+@app.route('/api/stats', methods=['GET'])
+def get_stats():
+    return jsonify({
+        "summary_cache": summary_cache.get_stats(),
+        "body_cache": body_cache.get_stats(),
+        "stream": get_stream_stats(),
+        "validation": get_validation_stats(),
+        "prompt": get_prompt_stats(),
+        "thunderbridge_rpc": thunderbridge_rpc.get_stats(),
+    })
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    counts = database.SummaryJob.counts()
+    for state in (database.SummaryJob.PENDING, database.SummaryJob.RUNNING,
+                  database.SummaryJob.DONE, database.SummaryJob.FAILED):
+        metrics.JOB_QUEUE.set(counts.get(state, 0), state=state)
+    metrics.WORKERS_BUSY.set(worker_pool.in_flight())
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/api/full-email/<id>', methods=['GET'])
 def api_get_full_email(id):
-    # Fetch the email header from the database.
-    email_header_obj = database.Message.by_header_message_id(id)
-    if not email_header_obj:
-        return jsonify({"error": "Email header not found"}), 404
-    email_header = email_header_obj.to_dict()
-    # Use SocketIO to request the email body.
-    email_body, reason = thunderbridge_sync('request_email_body', email_header)
-    if not email_body:
-        return jsonify({"error": f"Email body: {reason}"}), 404
-    # Combine the header and body.
-    full_email = {
-        "header": email_header,
-        "body": email_body
-    }
+    full_email, reason = get_full_email(id)
+    if not full_email:
+        return jsonify({"error": reason}), 404
     return jsonify(full_email)
 
 
@@ -398,14 +540,59 @@ def open_email():
     return jsonify({"status": "Message sent to Thunderbird successfully"}), 200
 
 
+def get_email_body(email_header):
+    """Body from the local cache, or from Thunderbird which then fills the cache."""
+    email_body = body_cache.lookup(email_header['header_message_id'])
+    metrics.annotate(body_cache_hit=email_body is not None)
+    if email_body is not None:
+        return email_body, "Success"
+    # Use SocketIO to request the email body.
+    email_body, reason = thunderbridge_sync('request_email_body', email_header)
+    if not email_body:
+        return None, reason
+    body_cache.store(email_header['header_message_id'], email_body)
+    return email_body, "Success"
+
+
+def fetch_email_bodies(header_message_ids):
+    """Fetch uncached bodies from Thunderbird in batches of body_batch_size.
+
+    :return: number of bodies added to the cache
+    """
+    fetched = 0
+    wanted = body_cache.missing(header_message_ids)
+    for start in range(0, len(wanted), settings.BODY_BATCH_SIZE):
+        batch = wanted[start:start + settings.BODY_BATCH_SIZE]
+        bodies, reason = thunderbridge_sync('request_email_bodies', {'header_message_ids': batch})
+        if not isinstance(bodies, dict):
+            print(f"Failed to fetch {len(batch)} email bodies: {reason}")
+            break
+        bodies = {header_message_id: body for header_message_id, body in bodies.items()
+                  if header_message_id in batch and isinstance(body, str)}
+        body_cache.store_many(bodies)
+        fetched += len(bodies)
+    return fetched
+
+
+def prefetch_bodies():
+    """Cache the bodies of the next queued jobs, one prefetcher at a time."""
+    if not settings.BODY_PREFETCH or not prefetch_lock.acquire(blocking=False):
+        return
+    try:
+        with app.app_context():
+            fetch_email_bodies(database.SummaryJob.upcoming(
+                settings.BODY_PREFETCH, settings.JOB_PRIORITY_AGING_PER_HOUR))
+    finally:
+        prefetch_lock.release()
+
+
 def get_full_email(message_id):
     # Fetch the email header from the database.
     email_header_obj = database.Message.by_header_message_id(message_id)
     if not email_header_obj:
         return None, "Email header not found"
     email_header = email_header_obj.to_dict()
-    # Use SocketIO to request the email body.
-    email_body, reason = thunderbridge_sync('request_email_body', email_header)
+    email_body, reason = get_email_body(email_header)
     if not email_body:
         return None, f"Failed to obtain email body - {reason}"
     # Combine the header and body.
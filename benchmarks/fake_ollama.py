@@ -0,0 +1,120 @@
+"""Stand-in for the Ollama `/api/generate` endpoint with a fixed generation latency.
+
+    python -m benchmarks.fake_ollama --port 11435 --latency 0.5 --parallel 4
+
+`--parallel` models `OLLAMA_NUM_PARALLEL`: requests beyond it wait for a free slot.
+Streamed replies are followed by `--chatter-tokens` tokens of prose after the
+JSON object, and stop early when the client disconnects, like Ollama does.
+A `--malformed-rate` share of replies is cut off in the middle of the object.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPLY = {"isCommerce": 0.1, "isSpam": 0.0, "isWork": 0.0,
+         "summary": "A short summary of the email."}
+CHATTER = " I hope this summary helps! Let me know if you need anything else."
+
+
+def tokenize(text):
+    return re.findall(r'\s*\S{1,4}', text)
+
+
+def make_handler(latency, slots, chatter_tokens, reject_schema=False, malformed_rate=0.0):
+    reply_tokens = tokenize(json.dumps(REPLY))
+    chatter = (tokenize(CHATTER) * (chatter_tokens // len(tokenize(CHATTER)) + 1))[:chatter_tokens]
+    valid_tokens = reply_tokens + chatter
+    # Truncated object, the kind of reply a model gives when it runs out of context
+    malformed_tokens = reply_tokens[:len(reply_tokens) // 2] + chatter
+    token_latency = latency / len(valid_tokens)
+
+    def pick_tokens():
+        return malformed_tokens if random.random() < malformed_rate else valid_tokens
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != '/api/generate':
+                self.send_error(404)
+                return
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}')
+            if reject_schema and isinstance(request.get('format'), dict):
+                # Ollama versions before structured outputs only accept "json"
+                self.send_error(400, 'invalid format')
+                return
+            if request.get('stream', True):
+                self.stream(request)
+            else:
+                self.complete(request)
+
+        def complete(self, request):
+            tokens = pick_tokens()
+            with slots:
+                time.sleep(latency)
+            body = json.dumps({'model': request.get('model'), 'response': ''.join(tokens),
+                               'done': True, 'eval_count': len(tokens)}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def stream(self, request):
+            tokens = pick_tokens()
+            with slots:
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.end_headers()
+                try:
+                    for token in tokens:
+                        time.sleep(token_latency)
+                        self.write_line({'model': request.get('model'), 'response': token,
+                                         'done': False})
+                    self.write_line({'model': request.get('model'), 'response': '',
+                                     'done': True, 'eval_count': len(tokens)})
+                except (BrokenPipeError, ConnectionResetError):
+                    # Client cancelled the generation, the slot is free again
+                    pass
+
+        def write_line(self, data):
+            self.wfile.write(json.dumps(data).encode() + b'\n')
+            self.wfile.flush()
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(port, latency, parallel, chatter_tokens, reject_schema=False, malformed_rate=0.0):
+    handler = make_handler(latency, threading.Semaphore(parallel), chatter_tokens, reject_schema,
+                           malformed_rate)
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=11435)
+    parser.add_argument('--latency', type=float, default=0.5,
+                        help='Seconds spent generating each full reply')
+    parser.add_argument('--parallel', type=int, default=4,
+                        help='Generations the server runs at once')
+    parser.add_argument('--chatter-tokens', type=int, default=0,
+                        help='Tokens of prose generated after the JSON object')
+    parser.add_argument('--reject-schema', action='store_true',
+                        help='Answer a JSON schema `format` with HTTP 400')
+    parser.add_argument('--malformed-rate', type=float, default=0.0,
+                        help='Share of replies cut off before the JSON object is complete')
+    args = parser.parse_args()
+    serve(args.port, args.latency, args.parallel, args.chatter_tokens, args.reject_schema,
+          args.malformed_rate)
+
+
+if __name__ == '__main__':
+    main()
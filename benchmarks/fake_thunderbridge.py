@@ -0,0 +1,165 @@
+"""Stand-in for the Thunderbird extension serving a synthetic mailbox over socket.io.
+
+    python -m benchmarks.fake_thunderbridge --url http://127.0.0.1:5000/ --messages 5000
+
+Answers fetch-emails by posting every folder page to /api/emails followed by
+folder-synced, and request_email_body(ies) with bodies built from the HTML
+fixtures. Folders with a checkpoint only resend messages newer than it.
+"""
+import argparse
+import os
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+
+import requests
+import socketio
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'html')
+WORDS = ['invoice', 'meeting', 'release', 'newsletter', 'order', 'shipped', 'update', 'weekly',
+         'report', 'invitation', 'security', 'alert', 'receipt', 'digest', 'reminder', 'offer']
+
+
+def load_bodies():
+    bodies = []
+    for name in sorted(os.listdir(FIXTURES)):
+        with open(os.path.join(FIXTURES, name), encoding='utf-8') as file:
+            bodies.append(file.read())
+    return bodies
+
+
+def make_mailbox(count, recent, accounts=2, folders=3, now=None):
+    """Synthetic messages, the newest `recent` within the last day and the rest older."""
+    now = now or time.time()
+    messages = []
+    for i in range(count):
+        if i < recent:
+            date = now - 60 - i * (80000 / max(recent, 1))
+        else:
+            date = now - 2 * 86400 - i * 60
+        account = f'account{i % accounts}'
+        words = ' '.join(WORDS[(i * 7 + k) % len(WORDS)] for k in range(3))
+        messages.append({
+            'headerMessageId': f'load-{i}@example.com',
+            'date': datetime.fromtimestamp(date, timezone.utc).isoformat().replace('+00:00', 'Z'),
+            'author': f'"Sender {i % 211}" <sender{i % 211}@domain{i % 17}.com>',
+            'subject': f'{words} #{i}',
+            'read': i % 3 == 0,
+            'flagged': i % 13 == 0,
+            'size': 2000 + i,
+            'folder': {'accountId': account, 'path': f'/Folder{i % folders}',
+                       'name': f'Folder{i % folders}', 'type': 'inbox'},
+        })
+    return messages
+
+
+class FakeThunderbridge:
+    def __init__(self, url, messages, page_size=100):
+        self.url = url
+        self.messages = {message['headerMessageId']: message for message in messages}
+        self.page_size = page_size
+        self.bodies = load_bodies()
+        # Label -> list of seconds
+        self.timings = {'POST /api/emails': []}
+        # header_message_id -> perf_counter time its page was accepted
+        self.ingested_at = {}
+        self.body_requests = {'request_email_body': 0, 'request_email_bodies': 0, 'bodies': 0}
+        self.synced = threading.Event()
+        self.http = requests.Session()
+        self.sio = socketio.Client(reconnection=False)
+        self.sio.on('connect', self.on_connect)
+        self.sio.on('fetch-emails', self.on_fetch_emails)
+        self.sio.on('request_email_body', self.on_request_email_body)
+        self.sio.on('request_email_bodies', self.on_request_email_bodies)
+
+    def connect(self):
+        self.sio.connect(self.url, transports=['polling'])
+
+    def on_connect(self):
+        self.sio.emit('thunderbridge-hello', 'Hello from the fake thunderbridge!')
+
+    def on_fetch_emails(self, data):
+        self.sio.start_background_task(self.sync, data)
+
+    def sync(self, data):
+        checkpoints = {(checkpoint['accountId'], checkpoint['path']): checkpoint['latest_date']
+                       for checkpoint in data.get('checkpoints', [])}
+        folders = {}
+        for message in self.messages.values():
+            folder = message['folder']
+            folders.setdefault((folder['accountId'], folder['path']), []).append(message)
+        for key, messages in folders.items():
+            latest = checkpoints.get(key)
+            if latest:
+                since = latest - data.get('overlap_seconds', 0)
+                messages = [message for message in messages if self.timestamp(message) >= since]
+            for start in range(0, len(messages), self.page_size):
+                self.post_page(messages[start:start + self.page_size])
+            self.sio.emit('folder-synced', {
+                'folder': messages[0]['folder'] if messages else folders[key][0]['folder'],
+                'latest_date': max((int(self.timestamp(message)) for message in messages), default=None),
+            })
+        self.synced.set()
+
+    @staticmethod
+    def timestamp(message):
+        return datetime.fromisoformat(message['date'].replace('Z', '+00:00')).timestamp()
+
+    def post_page(self, page):
+        started = time.perf_counter()
+        response = self.http.post(self.url + 'api/emails', json={'messages': page})
+        finished = time.perf_counter()
+        response.raise_for_status()
+        self.timings['POST /api/emails'].append(finished - started)
+        for message in page:
+            self.ingested_at[message['headerMessageId']] = finished
+
+    def body(self, header_message_id):
+        message = self.messages.get(header_message_id)
+        if not message:
+            return None
+        template = self.bodies[zlib.crc32(header_message_id.encode()) % len(self.bodies)]
+        # The subject keeps prompts distinct, so the summary cache does not answer for the model
+        return f"<h1>{message['subject']}</h1>\n{template}"
+
+    def on_request_email_body(self, data):
+        self.body_requests['request_email_body'] += 1
+        self.body_requests['bodies'] += 1
+        return self.body(data['header_message_id'])
+
+    def on_request_email_bodies(self, data):
+        self.body_requests['request_email_bodies'] += 1
+        bodies = {}
+        for header_message_id in data['header_message_ids']:
+            body = self.body(header_message_id)
+            if body is not None:
+                bodies[header_message_id] = body
+        self.body_requests['bodies'] += len(bodies)
+        return bodies
+
+    def disconnect(self):
+        self.sio.disconnect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:5000/')
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--recent', type=int, default=100,
+                        help='Messages dated within the last day')
+    parser.add_argument('--page-size', type=int, default=100)
+    args = parser.parse_args()
+
+    bridge = FakeThunderbridge(args.url, make_mailbox(args.messages, args.recent), args.page_size)
+    bridge.connect()
+    bridge.synced.wait()
+    print(f"Synced {len(bridge.ingested_at)} messages, serving bodies until interrupted")
+    try:
+        bridge.sio.wait()
+    except KeyboardInterrupt:
+        bridge.disconnect()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""Micro-benchmark of the HTML to text backends over a corpus of email bodies.
+
+Run from the repository root:
+
+    python -m benchmarks.html_to_text [--corpus DIR] [--repeat 200]
+
+The default corpus is benchmarks/fixtures/html. Point --corpus at a directory
+of saved .html/.txt bodies to measure your own mailbox.
+"""
+import argparse
+import os
+import time
+
+from bs4 import BeautifulSoup
+
+import html_text
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'html')
+
+
+def previous_html_to_text(html_content):
+    """The BeautifulSoup extraction summarizer used before backends existed."""
+    return BeautifulSoup(html_content, 'html.parser').get_text()
+
+
+def load_corpus(directory):
+    corpus = {}
+    for name in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, name), encoding='utf-8', errors='replace') as file:
+            corpus[name] = file.read()
+    return corpus
+
+
+def measure(extract, documents, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for document in documents:
+            html_text.collapse_whitespace(extract(document))
+    return (time.perf_counter() - started) / (repeat * len(documents))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--corpus', default=FIXTURES)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    total_bytes = sum(len(document.encode()) for document in corpus.values())
+    backends = {'previous bs4 (x2)': previous_html_to_text}
+    for name in html_text.BACKENDS:
+        if name == 'lxml' and html_text.lxml is None:
+            print("lxml is not installed, skipping its backend")
+            continue
+        backends[name] = html_text.BACKENDS[name]
+
+    print(f"{len(corpus)} documents, {total_bytes / 1024:.1f} KiB, {args.repeat} rounds")
+    for name, extract in backends.items():
+        # summarize used to extract every body twice
+        passes = 2 if name.startswith('previous') else 1
+        per_document = measure(extract, list(corpus.values()), args.repeat) * passes
+        print(f"{name:>18}: {per_document * 1000:7.3f} ms/email, "
+              f"{total_bytes / len(corpus) / per_document / 2 ** 20:7.2f} MiB/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Messages/sec of the /api/emails ingestion path, per-message vs bulk upsert.
+
+Run from the repository root:
+
+    python -m benchmarks.ingest --messages 5000 --page-size 100
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from flask import Flask
+
+import database
+
+
+def make_app(path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    database.db.init_app(app)
+    with app.app_context():
+        database.create_schema()
+    return app
+
+
+def make_messages(count, folders=3):
+    """Synthetic messages in the shape thunderbridge posts to /api/emails."""
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    return [{
+        'headerMessageId': f'bench-{i}@example.com',
+        'date': (start + timedelta(minutes=i)).isoformat().replace('+00:00', 'Z'),
+        'author': f'"Sender {i % 97}" <sender{i % 97}@domain{i % 13}.com>',
+        'subject': f'Benchmark message {i}',
+        'read': i % 3 == 0,
+        'flagged': i % 11 == 0,
+        'size': 1000 + i,
+        'folder': {'accountId': 'account1', 'path': f'/Folder{i % folders}',
+                   'name': f'Folder{i % folders}', 'type': 'inbox'},
+    } for i in range(count)]
+
+
+def pages(messages, page_size):
+    for i in range(0, len(messages), page_size):
+        yield messages[i:i + page_size]
+
+
+def ingest_per_message(page):
+    return [database.Message.create_and_add_to_db(data)[:2] for data in page]
+
+
+def ingest_bulk(page):
+    return database.Message.bulk_create_and_add_to_db(page)[0]
+
+
+def run(ingest, messages, page_size):
+    """Ingest all messages twice (first sync, then a full resync) on a fresh database."""
+    with tempfile.TemporaryDirectory() as tmp:
+        app = make_app(os.path.join(tmp, 'bench.db'))
+        timings = []
+        with app.app_context():
+            for _ in range(2):
+                started = time.perf_counter()
+                for page in pages(messages, page_size):
+                    results = ingest(page)
+                    assert all(status for status, _ in results), results
+                timings.append(time.perf_counter() - started)
+            assert database.Message.query.count() == len(messages)
+        return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--page-size', type=int, default=100)
+    args = parser.parse_args()
+
+    messages = make_messages(args.messages)
+    print(f"{args.messages} messages, pages of {args.page_size}")
+    for name, ingest in (('per-message', ingest_per_message), ('bulk', ingest_bulk)):
+        first, resync = run(ingest, messages, args.page_size)
+        print(f"{name:>12}: first sync {args.messages / first:9.0f} msg/s, "
+              f"resync {args.messages / resync:9.0f} msg/s")
+
+
+if __name__ == '__main__':
+    main()
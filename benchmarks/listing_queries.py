@@ -0,0 +1,93 @@
+"""SQL queries and time spent serializing a section page, lazy vs eager loaded relationships.
+
+Run from the repository root:
+
+    python -m benchmarks.listing_queries --messages 2000
+
+Exits with an error if the eager listing does not use a constant number of
+queries regardless of the page size.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy import event
+
+import database
+from benchmarks.ingest import make_app, make_messages
+from sections import SectionRegistry
+
+
+def add_summaries_and_tags(count):
+    for message_id in range(1, count + 1, 2):
+        database.db.session.add(database.MessageSummary(
+            message_id=message_id, summary=f"Summary {message_id}", isWork=0.1,
+            isCommerce=0.2, isSpam=0.0))
+        database.db.session.add(database.Tag(message_id=message_id, tag='$label1'))
+        database.db.session.add(database.Recipient(message_id=message_id, email='me@example.com'))
+    database.db.session.commit()
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self.on_execute)
+
+    def on_execute(self, *args):
+        self.count += 1
+
+
+def list_page(section, limit, eager):
+    if eager:
+        return section.page(limit)[0]
+    messages = database.db.session.scalars(section.query.limit(limit)).all()
+    return [message.to_dict(relationships=True) for message in messages]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    registry = SectionRegistry([{'name': 'all'}], [{'name': 'general', 'sections': ['all']}])
+    section = registry.sections['all']
+    with tempfile.TemporaryDirectory() as tmp:
+        app = make_app(os.path.join(tmp, 'bench.db'))
+        with app.app_context():
+            database.Message.bulk_create_and_add_to_db(make_messages(args.messages))
+            add_summaries_and_tags(args.messages)
+            registry.sync()
+            counter = QueryCounter(database.db.engine)
+
+            queries = {}
+            for eager in (False, True):
+                label = 'eager' if eager else 'lazy'
+                for limit in (10, 100):
+                    database.db.session.expunge_all()
+                    counter.count = 0
+                    page = list_page(section, limit, eager)
+                    assert len(page) == limit
+                    queries[(label, limit)] = counter.count
+                database.db.session.expunge_all()
+                started = time.perf_counter()
+                for _ in range(args.rounds):
+                    list_page(section, 100, eager)
+                    database.db.session.expunge_all()
+                elapsed = (time.perf_counter() - started) / args.rounds
+                print(f"{label:>6}: {queries[(label, 10)]:4} queries for 10 messages, "
+                      f"{queries[(label, 100)]:4} for 100, {elapsed * 1000:7.2f} ms per 100-message page")
+
+            database.db.session.expunge_all()
+            lazy_page = list_page(section, 100, False)
+            database.db.session.expunge_all()
+            assert list_page(section, 100, True) == lazy_page
+
+    if queries[('eager', 10)] != queries[('eager', 100)]:
+        sys.exit("Eager listing query count grows with the page size")
+
+
+if __name__ == '__main__':
+    main()
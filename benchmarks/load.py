@@ -0,0 +1,234 @@
+"""End-to-end load test of the server against fake Ollama and Thunderbird stand-ins.
+
+Run from the repository root:
+
+    python -m benchmarks.load --messages 2000 --summaries 100 --latency 0.2 --malformed-rate 0.05
+
+Starts benchmarks.fake_ollama and the app on a throwaway database, syncs a
+synthetic mailbox through benchmarks.fake_thunderbridge, reads listings from
+several threads while the queue is summarized, and reports p50/p99 latency and
+throughput per endpoint and pipeline stage.
+"""
+import argparse
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+import socketio
+import yaml
+
+from benchmarks.fake_thunderbridge import FakeThunderbridge, make_mailbox
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[max(math.ceil(q / 100 * len(ordered)) - 1, 0)]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Nothing is listening on port {port}")
+
+
+class FakeFrontend:
+    """Mailbox page subscribed to a tab, timing when summaries get pushed."""
+
+    def __init__(self, url, tab):
+        self.url = url
+        self.tab = tab
+        self.summary_ready_at = {}
+        self.sio = socketio.Client(reconnection=False)
+        self.sio.on('summary-ready', self.on_summary_ready)
+
+    def connect(self):
+        self.sio.connect(self.url, transports=['polling'])
+        self.sio.emit('frontend-hello', 'Hello from the load test!')
+        self.sio.call('subscribe', {'tab': self.tab})
+
+    def on_summary_ready(self, data):
+        self.summary_ready_at.setdefault(data['header_message_id'], time.perf_counter())
+
+    def disconnect(self):
+        self.sio.disconnect()
+
+
+def read_listings(url, tab, sections, requests_per_reader, timings, queries):
+    """One reader: section pages with cursor paging, counts and searches, round robin."""
+    http = requests.Session()
+
+    def get(label, path, **params):
+        started = time.perf_counter()
+        response = http.get(url + path, params=params)
+        timings.setdefault(label, []).append(time.perf_counter() - started)
+        response.raise_for_status()
+        return response.json()
+
+    for i in range(requests_per_reader):
+        kind = i % 4
+        if kind == 0:
+            get('GET /api/tabs/<tab>/sections', f'api/tabs/{tab}/sections')
+        elif kind == 1:
+            get('GET /api/tabs/<tab>/counts', f'api/tabs/{tab}/counts')
+        elif kind == 2:
+            section = sections[i % len(sections)]
+            page = get('GET /api/tabs/<tab>/sections/<section>/emails',
+                       f'api/tabs/{tab}/sections/{section}/emails', limit=30)
+            if page['next_cursor']:
+                get('GET /api/tabs/<tab>/sections/<section>/emails',
+                    f'api/tabs/{tab}/sections/{section}/emails', limit=30, cursor=page['next_cursor'])
+        else:
+            get('GET /api/search', 'api/search', q=queries[i % len(queries)])
+
+
+def stage_samples(trace_path):
+    """Seconds per job attempt for every pipeline stage, from the job trace lines."""
+    samples = {}
+    with open(trace_path) as file:
+        for line in file:
+            for stage, seconds in json.loads(line)['stages'].items():
+                samples.setdefault(stage, []).append(seconds)
+    return samples
+
+
+def report(rows):
+    print(f"{'':<56} {'count':>7} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9} {'per s':>9}")
+    for label, values, elapsed in rows:
+        if not values:
+            print(f"{label:<56} {0:>7}")
+            continue
+        throughput = len(values) / elapsed if elapsed else 0
+        print(f"{label:<56} {len(values):>7} {percentile(values, 50) * 1000:>9.1f} "
+              f"{percentile(values, 99) * 1000:>9.1f} {max(values) * 1000:>9.1f} {throughput:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--summaries', type=int, default=100,
+                        help='Messages recent enough to be summarized on ingest')
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.2,
+                        help='Seconds the fake model spends per generation')
+    parser.add_argument('--ollama-parallel', type=int, default=4)
+    parser.add_argument('--malformed-rate', type=float, default=0.05)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--reader-requests', type=int, default=200)
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--ollama-port', type=int, default=11436)
+    parser.add_argument('--timeout', type=float, default=600)
+    parser.add_argument('--trace-log', help='Keep the per-job trace lines in this file')
+    args = parser.parse_args()
+
+    url = f'http://127.0.0.1:{args.port}/'
+    with tempfile.TemporaryDirectory() as tmp:
+        # Stage percentiles are taken from the job traces
+        trace_path = os.path.abspath(args.trace_log or os.path.join(tmp, 'traces.jsonl'))
+        open(trace_path, 'w').close()
+        with open('config.yaml') as file:
+            config = yaml.safe_load(file)
+        config.update({
+            'database_uri': f"sqlite:///{os.path.join(tmp, 'load.db')}",
+            'ollama_url': f'http://127.0.0.1:{args.ollama_port}',
+            'ollama_parallelism': args.ollama_parallel,
+            'ollama_stream_calibration_rate': 0,
+            # Only the --summaries newest messages fall within the window
+            'auto_summarize_max_age_days': 1,
+            'metrics_trace_log': trace_path,
+        })
+        config_path = os.path.join(tmp, 'config.yaml')
+        with open(config_path, 'w') as file:
+            yaml.safe_dump(config, file)
+
+        log_path = os.path.join(tmp, 'server.log')
+        processes = []
+        frontend = bridge = None
+        try:
+            processes.append(subprocess.Popen(
+                [sys.executable, '-m', 'benchmarks.fake_ollama', '--port', str(args.ollama_port),
+                 '--latency', str(args.latency), '--parallel', str(args.ollama_parallel),
+                 '--malformed-rate', str(args.malformed_rate)]))
+            with open(log_path, 'w') as log:
+                processes.append(subprocess.Popen(
+                    [sys.executable, '-c',
+                     f"import app; app.socketio.run(app.app, host='127.0.0.1', port={args.port}, "
+                     f"log_output=False)"],
+                    env=dict(os.environ, TLDR_CONFIG=config_path), stdout=log, stderr=subprocess.STDOUT))
+            wait_for_port(args.ollama_port)
+            wait_for_port(args.port)
+
+            sections = [section['name'] for section in requests.get(url + 'api/tabs/general/sections').json()]
+            frontend = FakeFrontend(url, 'general')
+            frontend.connect()
+
+            mailbox = make_mailbox(args.messages, args.summaries)
+            bridge = FakeThunderbridge(url, mailbox, args.page_size)
+            started = time.perf_counter()
+            bridge.connect()
+            if not bridge.synced.wait(args.timeout):
+                sys.exit(f"Mailbox sync did not finish, see {log_path}")
+            ingest_elapsed = time.perf_counter() - started
+
+            # Readers compete with the summarizer's writes
+            listing_timings = {}
+            queries = ['invoice', 'weekly report', 'domain3', 'security alert']
+            readers = [threading.Thread(target=read_listings, args=(
+                url, 'general', sections, args.reader_requests, listing_timings, queries))
+                for _ in range(args.readers)]
+            listing_started = time.perf_counter()
+            for reader in readers:
+                reader.start()
+            for reader in readers:
+                reader.join()
+            listing_elapsed = time.perf_counter() - listing_started
+
+            deadline = time.perf_counter() + args.timeout
+            while len(frontend.summary_ready_at) < args.summaries and time.perf_counter() < deadline:
+                time.sleep(0.2)
+            summaries_elapsed = time.perf_counter() - started
+            stats = requests.get(url + 'api/stats').json()
+        finally:
+            for client in (frontend, bridge):
+                if client:
+                    client.disconnect()
+            for process in processes:
+                process.terminate()
+                process.wait()
+
+        summary_latencies = [ready_at - bridge.ingested_at[header_message_id]
+                             for header_message_id, ready_at in frontend.summary_ready_at.items()
+                             if header_message_id in bridge.ingested_at]
+
+        print(f"{args.messages} messages in pages of {args.page_size}, {args.summaries} to summarize, "
+              f"{args.latency}s per generation x {args.ollama_parallel}, "
+              f"{args.malformed_rate:.0%} malformed replies, {args.readers} readers")
+        rows = [('ingest: POST /api/emails', bridge.timings['POST /api/emails'], ingest_elapsed)]
+        rows.extend((f'listing: {label}', values, listing_elapsed)
+                    for label, values in sorted(listing_timings.items()))
+        rows.append(('summarize: ingest to summary-ready push', summary_latencies, summaries_elapsed))
+        rows.extend((f'job stage: {stage}', values, summaries_elapsed)
+                    for stage, values in sorted(stage_samples(trace_path).items()))
+        report(rows)
+        print(f"ingest throughput: {args.messages / ingest_elapsed:.0f} messages/s")
+        print(f"summarized {len(frontend.summary_ready_at)}/{args.summaries}, "
+              f"{len(frontend.summary_ready_at) / summaries_elapsed:.2f} summaries/s")
+        print(f"body requests: {bridge.body_requests}")
+        print(f"validation: {stats.get('validation')}")
+        if len(frontend.summary_ready_at) < args.summaries:
+            sys.exit("Not every message was summarized before the timeout")
+
+
+if __name__ == '__main__':
+    main()
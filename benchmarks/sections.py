@@ -0,0 +1,143 @@
+"""Section listing latency with a 50-section config, per-request filter building vs materialized membership.
+
+Run from the repository root:
+
+    python -m benchmarks.sections --sections 50 --messages 5000 --requests 200
+
+Also reports the one-off membership build and the cost it adds to ingesting a page.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from sqlalchemy import and_, or_
+
+import database
+from benchmarks.ingest import make_app, make_messages
+from sections import SectionRegistry
+
+
+def make_sections(count):
+    """Simple sections plus 'or', 'and' and 'exclude' groups of them."""
+    simple_count = count // 2
+    sections = []
+    for i in range(simple_count):
+        filter_type, value = [
+            ('sender_domain', f'domain{i % 13}.com'),
+            ('sender_email', f'sender{i % 97}@domain{i % 13}.com'),
+            ('subject_contains', f'message {i}'),
+            ('sender_name_contains', f'Sender {i}'),
+        ][i % 4]
+        sections.append({'name': f'simple{i}', 'filters': [{'type': filter_type, 'value': value}]})
+    for i in range(count - simple_count):
+        members = [f'simple{(i + offset) % simple_count}' for offset in range(3)]
+        if i % 3 == 0:
+            sections.append({'name': f'group{i}', 'or': members})
+        elif i % 3 == 1:
+            sections.append({'name': f'group{i}', 'and': members[:1], 'exclude': members[1:]})
+        else:
+            sections.append({'name': f'group{i}', 'or': [f'group{i - 2}', f'group{i - 1}'],
+                             'exclude': members[:1]})
+    tabs = [{'name': 'general', 'sections': [section['name'] for section in sections]}]
+    return sections, tabs
+
+
+def legacy_emails_by_section(sections_config, tabs_config, tab, section, limit):
+    """Route body as it was before sections were compiled."""
+    def get_filters_for_section(section_name):
+        section_config = next(
+            (sect for sect in sections_config if sect['name'] == section_name), None)
+        query_filters = []
+        if 'and' in section_config:
+            and_filters = [get_filters_for_section(name) for name in section_config['and']]
+            query_filters.extend([and_(*section_filters) for section_filters in and_filters])
+        for filter_def in section_config.get('filters', []):
+            if filter_def['type'] == 'sender_domain':
+                query_filters.append(database.Message.author_email.ilike(f"%@{filter_def['value']}"))
+            elif filter_def['type'] == 'sender_email':
+                query_filters.append(database.Message.author_email == filter_def['value'])
+            elif filter_def['type'] == 'subject_contains':
+                query_filters.append(database.Message.subject.ilike(f"%{filter_def['value']}%"))
+            elif filter_def['type'] == 'sender_name_contains':
+                query_filters.append(database.Message.author_name.ilike(f"%{filter_def['value']}%"))
+        if 'or' in section_config:
+            or_filters = [get_filters_for_section(name) for name in section_config['or']]
+            query_filters.append(or_(*[and_(*section_filters) for section_filters in or_filters]))
+        if 'exclude' in section_config:
+            exclude_filters = [get_filters_for_section(name) for name in section_config['exclude']]
+            for exclude_filter in exclude_filters:
+                query_filters.append(~and_(*exclude_filter))
+        return query_filters
+
+    tab_config = next((item for item in tabs_config if item['name'] == tab), None)
+    assert section in tab_config.get('sections', [])
+    query_filters = get_filters_for_section(section)
+    messages_query = (database.db.session.query(database.Message)
+                      .filter(and_(*query_filters))
+                      .order_by(database.Message.date.desc())
+                      .limit(limit))
+    return [message.id for message in messages_query.all()]
+
+
+def compiled_emails_by_section(registry, tab, section, limit):
+    compiled_section = next(item for item in registry.tab_sections(tab) if item.name == section)
+    return [message.id for message in
+            database.db.session.scalars(compiled_section.query.limit(limit))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sections', type=int, default=50)
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--limit', type=int, default=30)
+    parser.add_argument('--page', type=int, default=100,
+                        help='Messages ingested after the membership is built')
+    args = parser.parse_args()
+
+    sections_config, tabs_config = make_sections(args.sections)
+    names = [section['name'] for section in sections_config]
+    with tempfile.TemporaryDirectory() as tmp:
+        app = make_app(os.path.join(tmp, 'bench.db'))
+        with app.app_context():
+            database.Message.bulk_create_and_add_to_db(make_messages(args.messages))
+
+            started = time.perf_counter()
+            registry = SectionRegistry(sections_config, tabs_config)
+            compile_time = time.perf_counter() - started
+            started = time.perf_counter()
+            registry.sync()
+            build_time = time.perf_counter() - started
+
+            # Another page of messages, updating the membership of every section
+            page = make_messages(args.messages + args.page)[args.messages:]
+            started = time.perf_counter()
+            database.Message.bulk_create_and_add_to_db(page)
+            ingest_time = time.perf_counter() - started
+
+            for name in names:
+                assert (legacy_emails_by_section(sections_config, tabs_config, 'general', name, args.limit)
+                        == compiled_emails_by_section(registry, 'general', name, args.limit)), name
+
+            timings = {}
+            for label, handler in (
+                    ('per-request', lambda name: legacy_emails_by_section(
+                        sections_config, tabs_config, 'general', name, args.limit)),
+                    ('membership', lambda name: compiled_emails_by_section(
+                        registry, 'general', name, args.limit))):
+                started = time.perf_counter()
+                for i in range(args.requests):
+                    handler(names[-1 - i % 10])
+                timings[label] = (time.perf_counter() - started) / args.requests
+
+    print(f"{args.sections} sections, {args.messages} messages, "
+          f"compiled once in {compile_time * 1000:.1f} ms, "
+          f"membership built in {build_time * 1000:.1f} ms")
+    print(f"ingesting {args.page} more messages: {ingest_time * 1000:.1f} ms")
+    for label, seconds in timings.items():
+        print(f"{label:>12}: {seconds * 1000:7.3f} ms/request")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""Listing reads while summaries are committed, SQLAlchemy defaults vs the tuned SQLite profile.
+
+Run from the repository root:
+
+    python -m benchmarks.sqlite_concurrency --messages 20000 --readers 4 --seconds 5
+
+Reader threads page through a section with its summaries eager loaded while a
+writer thread commits one summary at a time, like the summarizer does. The
+default profile runs SQLite in rollback journal mode, where every commit waits
+for readers to finish and blocks new ones; the tuned profile applies the
+sqlite_* settings (WAL, synchronous=normal, mmap, cache and busy timeout).
+"""
+import argparse
+import math
+import os
+import random
+import tempfile
+import threading
+import time
+
+from flask import Flask
+from sqlalchemy import text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+import database
+from benchmarks.ingest import make_app, make_messages
+from sections import SectionRegistry
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[max(math.ceil(q / 100 * len(ordered)) - 1, 0)] if ordered else 0.0
+
+
+def make_tuned_app(path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    database.init_app(app)
+    return app
+
+
+def read_pages(engine, section, limit, stop, results):
+    latencies, errors = [], 0
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            with Session(engine) as session:
+                page = session.scalars(section.query.options(*database.Message.listing_options())
+                                       .limit(limit)).unique().all()
+                for message in page:
+                    message.to_dict(relationships=True, json_ready=True)
+        except OperationalError:
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - started)
+    results.append((latencies, errors))
+
+
+def write_summaries(engine, message_count, stop, results):
+    """Add or replace the summary of a random message per commit, a message has one summary."""
+    latencies, errors = [], 0
+    written = 0
+    while not stop.is_set():
+        message_id = random.randint(1, message_count)
+        written += 1
+        stmt = sqlite_insert(database.MessageSummary).values(
+            message_id=message_id, summary=f"Summary {written} of {message_id}",
+            isWork=0.1, isCommerce=0.2, isSpam=0.0)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[database.MessageSummary.message_id],
+            set_={key: stmt.excluded[key] for key in ('summary', 'isWork', 'isCommerce', 'isSpam')})
+        started = time.perf_counter()
+        try:
+            with Session(engine) as session:
+                session.execute(stmt)
+                session.commit()
+        except OperationalError:
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - started)
+    results.append((latencies, errors))
+
+
+def run(make, messages, readers, seconds, limit):
+    registry = SectionRegistry([{'name': 'all'}], [{'name': 'general', 'sections': ['all']}])
+    with tempfile.TemporaryDirectory() as tmp:
+        app = make(os.path.join(tmp, 'bench.db'))
+        with app.app_context():
+            database.Message.bulk_create_and_add_to_db(make_messages(messages))
+            registry.sync()
+            engine = database.db.engine
+            journal_mode = database.db.session.execute(text('PRAGMA journal_mode')).scalar()
+            database.db.session.remove()
+
+        stop = threading.Event()
+        read_results, write_results = [], []
+        threads = [threading.Thread(target=read_pages, args=(
+            engine, registry.sections['all'], limit, stop, read_results)) for _ in range(readers)]
+        threads.append(threading.Thread(target=write_summaries, args=(engine, messages, stop, write_results)))
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        engine.dispose()
+
+    reads = [latency for latencies, _ in read_results for latency in latencies]
+    writes = [latency for latencies, _ in write_results for latency in latencies]
+    return {
+        'journal_mode': journal_mode,
+        'reads': reads,
+        'read_errors': sum(errors for _, errors in read_results),
+        'writes': writes,
+        'write_errors': sum(errors for _, errors in write_results),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--limit', type=int, default=30)
+    args = parser.parse_args()
+
+    print(f"{args.messages} messages, {args.readers} readers and 1 writer for {args.seconds}s, "
+          f"pages of {args.limit}")
+    for label, make in (('default', make_app), ('tuned', make_tuned_app)):
+        result = run(make, args.messages, args.readers, args.seconds, args.limit)
+        reads, writes = result['reads'], result['writes']
+        print(f"{label:>8} ({result['journal_mode']}): "
+              f"{len(reads) / args.seconds:7.1f} reads/s, p50 {percentile(reads, 50) * 1000:6.2f} ms, "
+              f"p99 {percentile(reads, 99) * 1000:7.2f} ms | "
+              f"{len(writes) / args.seconds:7.1f} commits/s, p50 {percentile(writes, 50) * 1000:6.2f} ms, "
+              f"p99 {percentile(writes, 99) * 1000:7.2f} ms | "
+              f"locked errors: {result['read_errors']} reads, {result['write_errors']} commits")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Summarization throughput of the worker pool against a fake Ollama server.
+
+Run from the repository root:
+
+    python -m benchmarks.worker_pool --jobs 40 --latency 0.25 --server-parallel 4
+    python -m benchmarks.worker_pool --parallelism 1 --chatter-tokens 60 [--no-stream]
+"""
+import eventlet
+eventlet.monkey_patch()
+
+import argparse
+import socket
+import subprocess
+import sys
+import time
+
+import llm
+import settings
+from workers import WorkerPool
+
+
+def wait_for_port(port, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"Fake Ollama server did not start on port {port}")
+
+
+def run(jobs, parallelism):
+    llm.ollama_lock = llm.PrioritySlots(parallelism)
+    pending = list(range(jobs))
+    failures = []
+
+    def claim():
+        return pending.pop() if pending else None
+
+    def handle(job):
+        result, reason = llm.llm(f"Subject: benchmark {job}", print_fn=lambda _: None)
+        if not result:
+            failures.append(reason)
+
+    started = time.perf_counter()
+    WorkerPool(parallelism, claim, handle).run(stop_when_idle=True)
+    elapsed = time.perf_counter() - started
+    assert not failures, failures
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--jobs', type=int, default=40)
+    parser.add_argument('--latency', type=float, default=0.25)
+    parser.add_argument('--server-parallel', type=int, default=4)
+    parser.add_argument('--port', type=int, default=11435)
+    parser.add_argument('--parallelism', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--chatter-tokens', type=int, default=0,
+                        help='Tokens the fake model generates after the JSON object')
+    parser.add_argument('--no-stream', action='store_true',
+                        help='Wait for complete replies instead of streaming')
+    args = parser.parse_args()
+
+    server = subprocess.Popen([sys.executable, '-m', 'benchmarks.fake_ollama',
+                               '--port', str(args.port), '--latency', str(args.latency),
+                               '--parallel', str(args.server_parallel),
+                               '--chatter-tokens', str(args.chatter_tokens)])
+    try:
+        wait_for_port(args.port)
+        settings.OLLAMA_URL = f'http://127.0.0.1:{args.port}'
+        settings.OLLAMA_STREAM = not args.no_stream
+        settings.OLLAMA_STREAM_CALIBRATION_RATE = 0
+        print(f"{args.jobs} jobs, {args.latency}s per generation, "
+              f"server runs {args.server_parallel} in parallel")
+        for parallelism in args.parallelism:
+            elapsed = run(args.jobs, parallelism)
+            print(f"parallelism {parallelism:>2}: {args.jobs / elapsed:6.2f} emails/s")
+    finally:
+        server.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+import time
+import zlib
+
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+import database
+import settings
+
+stats = {'hits': 0, 'misses': 0}
+
+
+def lookup(header_message_id):
+    """Return the cached body of a message, or None on a miss."""
+    entry = database.MessageBody.query.filter_by(header_message_id=header_message_id).first()
+    if not entry:
+        stats['misses'] += 1
+        return None
+    entry.last_used_at = time.time()
+    database.db.session.commit()
+    stats['hits'] += 1
+    return zlib.decompress(entry.body).decode()
+
+
+def missing(header_message_ids):
+    """The given message ids whose bodies are not cached, in the same order."""
+    cached = {header_message_id for (header_message_id,) in database.db.session.query(
+        database.MessageBody.header_message_id)
+        .filter(database.MessageBody.header_message_id.in_(header_message_ids))}
+    return [header_message_id for header_message_id in header_message_ids
+            if header_message_id not in cached]
+
+
+def store(header_message_id, body):
+    store_many({header_message_id: body})
+
+
+def store_many(bodies):
+    """Cache a dict of header_message_id -> body in one transaction."""
+    if not bodies:
+        return
+    now = time.time()
+    rows = []
+    for header_message_id, body in bodies.items():
+        raw = body.encode()
+        compressed = zlib.compress(raw, 6)
+        rows.append({'header_message_id': header_message_id, 'body': compressed,
+                     'size': len(compressed), 'raw_size': len(raw),
+                     'created_at': now, 'last_used_at': now})
+    stmt = sqlite_insert(database.MessageBody)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[database.MessageBody.header_message_id],
+        set_={key: stmt.excluded[key] for key in ('body', 'size', 'raw_size', 'last_used_at')})
+    database.db.session.execute(stmt, rows)
+    database.db.session.commit()
+    evict(settings.BODY_CACHE_SIZE_MB * 1024 * 1024)
+
+
+def evict(max_bytes):
+    """Drop least recently used bodies until the compressed total fits in max_bytes."""
+    total = database.db.session.query(
+        func.coalesce(func.sum(database.MessageBody.size), 0)).scalar()
+    excess = total - max_bytes
+    if excess <= 0:
+        return
+    stale_ids = []
+    for entry_id, size in (database.db.session.query(database.MessageBody.id, database.MessageBody.size)
+                           .order_by(database.MessageBody.last_used_at)
+                           .yield_per(100)):
+        stale_ids.append(entry_id)
+        excess -= size
+        if excess <= 0:
+            break
+    (database.MessageBody.query
+     .filter(database.MessageBody.id.in_(stale_ids))
+     .delete(synchronize_session=False))
+    database.db.session.commit()
+
+
+def get_stats():
+    entries, size, raw_size = database.db.session.query(
+        func.count(database.MessageBody.id),
+        func.coalesce(func.sum(database.MessageBody.size), 0),
+        func.coalesce(func.sum(database.MessageBody.raw_size), 0),
+    ).one()
+    lookups = stats['hits'] + stats['misses']
+    return {
+        'entries': entries,
+        'bytes': size,
+        'uncompressed_bytes': raw_size,
+        'max_bytes': settings.BODY_CACHE_SIZE_MB * 1024 * 1024,
+        'hits': stats['hits'],
+        'misses': stats['misses'],
+        'hit_rate': stats['hits'] / lookups if lookups else 0.0,
+    }
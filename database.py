@@ -1,24 +1,103 @@
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import Index
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy import (DateTime, Index, and_, bindparam, case, column, delete, event, false, func,
+                        insert, literal, or_, select, table, text, tuple_, update)
+from sqlalchemy.engine import make_url
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError, OperationalError
 from sqlalchemy.inspection import inspect
+from sqlalchemy.orm import joinedload, selectinload
 from datetime import datetime
+from functools import lru_cache
 from sqlalchemy.orm.attributes import InstrumentedAttribute
 from sqlalchemy.orm.collections import InstrumentedList
+import base64
+import os
 import re
+import time
+
+import metrics
+import settings
 
 db = SQLAlchemy()
 
 
+def count_query(*args):
+    metrics.count_query()
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Performance profile of every new SQLite connection, see the sqlite_* settings."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={settings.SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA mmap_size={int(settings.SQLITE_MMAP_SIZE_MB * 1024 * 1024)}")
+    # Negative sizes are in KiB rather than pages
+    cursor.execute(f"PRAGMA cache_size={-int(settings.SQLITE_CACHE_SIZE_MB * 1024)}")
+    cursor.execute(f"PRAGMA busy_timeout={int(settings.SQLITE_BUSY_TIMEOUT_MS)}")
+    cursor.close()
+
+
+def tune_sqlite(engine):
+    if engine.dialect.name == 'sqlite':
+        event.listen(engine, 'connect', set_sqlite_pragmas)
+
+
+def sqlite_path(uri):
+    """File of a SQLite database URI, None for in-memory databases and other backends."""
+    url = make_url(uri)
+    if url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:'):
+        return None
+    return url.database
+
+
+def engine_options(uri):
+    if make_url(uri).get_backend_name() == 'sqlite' and not sqlite_path(uri):
+        # In-memory databases live in a single connection, there is nothing to pool
+        return {}
+    return {'pool_size': settings.DATABASE_POOL_SIZE, 'max_overflow': settings.DATABASE_POOL_SIZE}
+
+
 def init_app(app):
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:////Users/oleksiihorishnii/.llm-mail-summarizer/database.db'
+    app.config.setdefault('SQLALCHEMY_DATABASE_URI', settings.DATABASE_URI)
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config['SQLALCHEMY_DATABASE_URI']))
     # You might want to add this to suppress a warning
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    path = sqlite_path(app.config['SQLALCHEMY_DATABASE_URI'])
+    if path:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
     db.init_app(app)
 
     with app.app_context():
-        db.create_all()
+        tune_sqlite(db.engine)
+        event.listen(db.engine, 'before_cursor_execute', count_query)
+        create_schema()
+
+
+# Indexes older databases may still have to maintain on every write
+RETIRED_INDEXES = ['index_message_summary_message', 'index_date_id']
+
+
+def create_schema():
+    db.create_all()
+    drop_duplicate_summaries()
+    for name in RETIRED_INDEXES:
+        db.session.execute(text(f"DROP INDEX IF EXISTS {name}"))
+    db.session.commit()
+    # create_all skips the indexes of tables that already exist
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+    create_search_index()
+
+
+def drop_duplicate_summaries():
+    """Keep the latest summary of each message, older databases could store several."""
+    latest = select(func.max(MessageSummary.id)).group_by(MessageSummary.message_id)
+    removed = db.session.execute(delete(MessageSummary).where(MessageSummary.id.not_in(latest))).rowcount
+    db.session.commit()
+    if removed:
+        print(f"Removed {removed} duplicate message summaries")
 
 
 def add_unique_item_to_db(model, unique_field_names, **kwargs):
@@ -69,27 +148,45 @@ def split_email_handle(full_string):
 # Classes
 
 
+@lru_cache(maxsize=None)
+def mapper_fields(model):
+    """Column keys, DateTime column keys and relationship keys of a model, inspected once."""
+    mapper = inspect(model)
+    columns = tuple(c.key for c in mapper.column_attrs)
+    datetime_columns = tuple(c.key for c in mapper.column_attrs
+                             if isinstance(c.expression.type, DateTime))
+    relationships = tuple(rel.key for rel in mapper.relationships)
+    return columns, datetime_columns, relationships
+
+
 class BaseMixin:
-    def to_dict(self, relationships=False):
+    def to_dict(self, relationships=False, json_ready=False):
+        """Columns and optionally relationships of the model as a dict.
+
+        :param json_ready: Convert datetimes to ISO strings, for API responses
+        """
+        columns, datetime_columns, relationship_keys = mapper_fields(type(self))
         # Columns
-        columns = [c.key for c in inspect(self).mapper.column_attrs]
         data = {col: getattr(self, col) for col in columns}
+        if json_ready:
+            for col in datetime_columns:
+                if data[col] is not None:
+                    data[col] = data[col].isoformat()
         if relationships:
-            relationships = inspect(self).mapper.relationships
-            for rel in relationships:
-                value = getattr(self, rel.key)
+            for key in relationship_keys:
+                value = getattr(self, key)
                 if value is None:
-                    data[rel.key] = None
+                    data[key] = None
                 # For lists (e.g., one-to-many relationships)
                 elif isinstance(value, InstrumentedList):
-                    data[rel.key] = [item.to_dict() for item in value]
+                    data[key] = [item.to_dict(json_ready=json_ready) for item in value]
                 # For single objects (e.g., many-to-one relationships)
                 elif isinstance(value, InstrumentedAttribute):
-                    data[rel.key] = value.to_dict()
+                    data[key] = value.to_dict(json_ready=json_ready)
                 elif isinstance(value, BaseMixin):
-                    data[rel.key] = value.to_dict()
+                    data[key] = value.to_dict(json_ready=json_ready)
                 else:
-                    data[rel.key] = str(value)
+                    data[key] = str(value)
         return data
 
     def add_to_db(self):
@@ -145,6 +242,31 @@ class Folder(db.Model, BaseMixin):
             type=data.get('type', "")
         )
 
+    @classmethod
+    def resolve_many(cls, folders):
+        """Find or create all given folders with a single lookup query.
+
+        Changes are flushed but not committed, so the caller owns the transaction.
+
+        :param folders: Iterable of Folder instances built with from_data
+        :return: dict mapping (accountId, path) to the persisted Folder
+        """
+        wanted = {(folder.accountId, folder.path): folder for folder in folders}
+        if not wanted:
+            return {}
+        existing = db.session.query(cls).filter(
+            tuple_(cls.accountId, cls.path).in_(list(wanted.keys()))).all()
+        resolved = {(folder.accountId, folder.path): folder for folder in existing}
+        for key, folder in wanted.items():
+            if key in resolved:
+                resolved[key].name = folder.name
+                resolved[key].type = folder.type
+            else:
+                db.session.add(folder)
+                resolved[key] = folder
+        db.session.flush()
+        return resolved
+
     def unique_fields(self):
         return ["accountId", "path"]
 
@@ -219,9 +341,110 @@ class Message(db.Model, BaseMixin):
         if folder_status:
             message = cls.from_data(data)
             message.folder_id = folder.id
-            return message.add_to_db()
+            status, message_text, message = message.add_to_db()
+            if status:
+                index_messages([message.id])
+                update_memberships([message.id])
+                DataVersion.bump()
+                db.session.commit()
+            return status, message_text, message
         return False, folder_message, None
 
+    @classmethod
+    def bulk_create_and_add_to_db(cls, messages_data):
+        """Add or update a page of messages in a single transaction.
+
+        Folders of the page are resolved once and messages are written with one
+        `INSERT ... ON CONFLICT(header_message_id) DO UPDATE` statement, which
+        leaves rows alone that would not change.
+
+        :param messages_data: List of message dicts as sent by thunderbridge
+        :return: tuple (results, changed), results has a (status: bool, message: str)
+            per input message and changed the header ids that were inserted or updated,
+            None if the page could not be stored
+        """
+        results = [None] * len(messages_data)
+        parsed = []
+        for idx, data in enumerate(messages_data):
+            try:
+                folder = Folder.from_data(data['folder'])
+                message = cls.from_data(data)
+            except (KeyError, TypeError, ValueError, AttributeError) as e:
+                results[idx] = (False, f"Invalid message data: {e}")
+                continue
+            parsed.append((idx, folder, message))
+        if not parsed:
+            return results, []
+
+        header_ids = [message.header_message_id for _, _, message in parsed]
+        try:
+            folders = Folder.resolve_many(folder for _, folder, _ in parsed)
+            existing_ids = {header_id for (header_id,) in db.session.query(
+                cls.header_message_id).filter(cls.header_message_id.in_(header_ids))}
+
+            # Later duplicates within a page win, as they would with sequential upserts
+            rows = {}
+            for idx, folder, message in parsed:
+                message.folder_id = folders[(folder.accountId, folder.path)].id
+                row = message.to_dict()
+                del row['id']
+                rows[message.header_message_id] = row
+
+            columns = [key for key in next(iter(rows.values())) if key != 'header_message_id']
+            stmt = sqlite_insert(cls)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[cls.header_message_id],
+                set_={key: stmt.excluded[key] for key in columns},
+                # Only rewrite rows that differ, so a resync leaves unchanged messages alone
+                where=or_(*(getattr(cls, key).is_distinct_from(stmt.excluded[key]) for key in columns)))
+            changed = {header_id for (header_id,) in db.session.execute(
+                stmt.returning(cls.header_message_id), list(rows.values()))}
+            for idx, _, message in parsed:
+                if message.header_message_id not in existing_ids:
+                    results[idx] = (True, f"{cls.__name__} added successfully.")
+                    existing_ids.add(message.header_message_id)
+                elif message.header_message_id in changed:
+                    results[idx] = (True, f"{cls.__name__} updated successfully.")
+                else:
+                    results[idx] = (True, f"{cls.__name__} unchanged.")
+            if changed:
+                message_ids = [message_id for (message_id,) in db.session.query(cls.id)
+                               .filter(cls.header_message_id.in_(list(changed)))]
+                index_messages(message_ids)
+                update_memberships(message_ids)
+                DataVersion.bump()
+            db.session.commit()
+        except IntegrityError as e:
+            db.session.rollback()
+            print(str(e))
+            failure = (False, f"Database integrity error occurred while processing {cls.__name__}.")
+            for idx, _, _ in parsed:
+                results[idx] = failure
+            return results, None
+        return results, [header_id for header_id in rows if header_id in changed]
+
+    @staticmethod
+    def encode_cursor(message):
+        """Opaque keyset cursor pointing right after the given message."""
+        return base64.urlsafe_b64encode(f"{message.date}:{message.id}".encode()).decode().rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor):
+        """Decode a cursor into a (date, id) tuple, or None if it is malformed."""
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            date, message_id = base64.urlsafe_b64decode(padded).decode().split(':')
+            return int(date), int(message_id)
+        except (ValueError, UnicodeDecodeError):
+            return None
+
+    @classmethod
+    def listing_options(cls):
+        """Loader options fetching everything to_dict(relationships=True) reads,
+        so serializing a page takes a constant number of queries."""
+        return (selectinload(cls.recipients), selectinload(cls.tags),
+                joinedload(cls.folder), joinedload(cls.summary))
+
     @classmethod
     def by_header_message_id(cls, header_message_id):
         message = Message.query.filter_by(
@@ -256,10 +479,303 @@ class MessageSummary(db.Model, BaseMixin):
             isSpam=data['isSpam']
         )
 
+    def add_to_db(self):
+        status, message, summary = super().add_to_db()
+        if status:
+            index_messages([summary.message_id])
+            DataVersion.bump()
+            db.session.commit()
+        return status, message, summary
+
     def unique_fields(self):
         return ["message_id"]
 
 
+class SummaryJob(db.Model, BaseMixin):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    id = db.Column(db.Integer, primary_key=True)
+    header_message_id = db.Column(db.String, unique=True, nullable=False)
+    # One of PENDING, RUNNING, DONE or FAILED
+    state = db.Column(db.String, nullable=False, default=PENDING)
+    # Higher priority runs first
+    priority = db.Column(db.Integer, nullable=False, default=0)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.String, nullable=True)
+    enqueued_at = db.Column(db.Float, nullable=False)  # Unix timestamp
+    # Failed attempts are retried no earlier than this Unix timestamp
+    available_at = db.Column(db.Float, nullable=False)
+    updated_at = db.Column(db.Float, nullable=False)
+
+    @classmethod
+    def enqueue(cls, header_message_id, priority):
+        """Add a pending job, deduplicated per message.
+
+        A job that is already pending or running only gets its priority raised,
+        a failed job is reset to pending and a done job is left untouched.
+        """
+        cls.enqueue_many({header_message_id: priority}, retry_failed=True)
+
+    @classmethod
+    def enqueue_many(cls, priorities, retry_failed=False):
+        """Enqueue several jobs in one statement, same rules as enqueue.
+
+        :param priorities: dict of header_message_id -> priority
+        :param retry_failed: Reset failed jobs to pending, only for an explicit request of the
+            user, background enqueues would otherwise retry them forever
+        """
+        if not priorities:
+            return
+        now = time.time()
+        failed = (cls.state == cls.FAILED) if retry_failed else false()
+        stmt = sqlite_insert(cls)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[cls.header_message_id],
+            set_={
+                'state': case((failed, cls.PENDING), else_=cls.state),
+                'priority': case((failed, stmt.excluded.priority),
+                                 else_=func.max(cls.priority, stmt.excluded.priority)),
+                'attempts': case((failed, 0), else_=cls.attempts),
+                'enqueued_at': case((failed, stmt.excluded.enqueued_at), else_=cls.enqueued_at),
+                'available_at': case((failed, stmt.excluded.available_at), else_=cls.available_at),
+                'updated_at': stmt.excluded.updated_at,
+            })
+        db.session.execute(stmt, [{
+            'header_message_id': header_message_id, 'state': cls.PENDING, 'priority': priority,
+            'attempts': 0, 'enqueued_at': now, 'available_at': now, 'updated_at': now,
+        } for header_message_id, priority in priorities.items()])
+        db.session.commit()
+
+    @classmethod
+    def reprioritize(cls, priorities):
+        """Set the priority of jobs that are still pending, up or down.
+
+        :param priorities: dict of header_message_id -> priority
+        """
+        if not priorities:
+            return
+        stmt = (update(cls.__table__)
+                .where(cls.__table__.c.header_message_id == bindparam('job_header_message_id'),
+                       cls.__table__.c.state == cls.PENDING)
+                .values(priority=bindparam('job_priority'), updated_at=time.time()))
+        db.session.execute(stmt, [{'job_header_message_id': header_message_id, 'job_priority': priority}
+                                  for header_message_id, priority in priorities.items()])
+        db.session.commit()
+
+    @classmethod
+    def urgency(cls, now, aging_per_hour):
+        """Priority plus what a job gained while waiting, in hours like background priorities."""
+        return cls.priority + (now - cls.enqueued_at) / 3600 * aging_per_hour
+
+    @classmethod
+    def claim_next(cls, aging_per_hour=0.0, min_priority=None, below_priority=None):
+        """Atomically move the most urgent available pending job to RUNNING.
+
+        Waiting jobs gain `aging_per_hour` priority for every hour spent in the queue.
+
+        :param min_priority: Only consider jobs enqueued with at least this priority
+        :param below_priority: Only consider jobs enqueued with a priority lower than this
+        :return: the claimed job, or None if nothing is available
+        """
+        now = time.time()
+        filters = [cls.state == cls.PENDING, cls.available_at <= now]
+        if min_priority is not None:
+            filters.append(cls.priority >= min_priority)
+        if below_priority is not None:
+            filters.append(cls.priority < below_priority)
+        while True:
+            job = (db.session.query(cls)
+                   .filter(*filters)
+                   .order_by(cls.urgency(now, aging_per_hour).desc(), cls.id)
+                   .first())
+            if not job:
+                db.session.commit()
+                return None
+            claimed = (db.session.query(cls)
+                       .filter(cls.id == job.id, cls.state == cls.PENDING)
+                       .update({'state': cls.RUNNING, 'attempts': cls.attempts + 1,
+                                'updated_at': now}, synchronize_session='fetch'))
+            db.session.commit()
+            if claimed:
+                return job
+
+    def complete(self):
+        self.state = self.DONE
+        self.last_error = None
+        self.updated_at = time.time()
+        db.session.commit()
+
+    def fail(self, reason, max_attempts, retry_delay):
+        """Schedule a retry with linear backoff, or give up after max_attempts."""
+        now = time.time()
+        self.last_error = reason
+        self.updated_at = now
+        if self.attempts >= max_attempts:
+            self.state = self.FAILED
+        else:
+            self.state = self.PENDING
+            self.available_at = now + retry_delay * self.attempts
+        db.session.commit()
+
+    @classmethod
+    def upcoming(cls, limit, aging_per_hour=0.0):
+        """Header ids of the pending jobs most likely to be claimed next, in claim_next's order."""
+        return [header_message_id for (header_message_id,) in db.session.query(cls.header_message_id)
+                .filter(cls.state == cls.PENDING)
+                .order_by(cls.urgency(time.time(), aging_per_hour).desc(), cls.id)
+                .limit(limit)]
+
+    @classmethod
+    def counts(cls):
+        """Number of jobs per state."""
+        return dict(db.session.query(cls.state, func.count(cls.id)).group_by(cls.state).all())
+
+    @classmethod
+    def recover(cls):
+        """Return jobs left RUNNING by a previous process to the queue.
+
+        :return: number of pending jobs after recovery
+        """
+        (db.session.query(cls)
+         .filter(cls.state == cls.RUNNING)
+         .update({'state': cls.PENDING, 'updated_at': time.time()}))
+        db.session.commit()
+        return db.session.query(cls).filter(cls.state == cls.PENDING).count()
+
+    def unique_fields(self):
+        return ["header_message_id"]
+
+
+class SummaryCacheEntry(db.Model, BaseMixin):
+    id = db.Column(db.Integer, primary_key=True)
+    # Hash of the normalized prompt, model name and field_checks schema version
+    key = db.Column(db.String, unique=True, nullable=False)
+    # Validated LLM result as JSON
+    result = db.Column(db.String, nullable=False)
+    # Time the original generation took, saved again by every hit
+    generation_seconds = db.Column(db.Float, nullable=False, default=0.0)
+    hits = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.Float, nullable=False)  # Unix timestamp
+    last_used_at = db.Column(db.Float, nullable=False)  # Unix timestamp
+
+    def unique_fields(self):
+        return ["key"]
+
+
+class SyncCheckpoint(db.Model, BaseMixin):
+    """How far thunderbridge got syncing a folder, so reconnects only send what is new."""
+    id = db.Column(db.Integer, primary_key=True)
+    folder_id = db.Column(db.Integer, db.ForeignKey(
+        'folder.id'), unique=True, nullable=False)
+    # Date of the newest message of the last completed sync, Unix timestamp
+    latest_date = db.Column(db.Integer, nullable=True)
+    synced_at = db.Column(db.Float, nullable=False)  # Unix timestamp
+
+    folder = db.relationship('Folder')
+
+    @classmethod
+    def advance(cls, folder_data, latest_date):
+        """Record a completed folder sync, the high-water mark never moves back."""
+        folder = Folder.from_data(folder_data)
+        folder = Folder.resolve_many([folder])[(folder.accountId, folder.path)]
+        stmt = sqlite_insert(cls).values(
+            folder_id=folder.id, latest_date=latest_date, synced_at=time.time())
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=[cls.folder_id],
+            set_={'latest_date': func.max(func.coalesce(cls.latest_date, stmt.excluded.latest_date),
+                                          func.coalesce(stmt.excluded.latest_date, cls.latest_date)),
+                  'synced_at': stmt.excluded.synced_at}))
+        db.session.commit()
+
+    @classmethod
+    def for_sync(cls):
+        """Checkpoints of all folders in the shape sent to thunderbridge."""
+        return [{'accountId': checkpoint.folder.accountId, 'path': checkpoint.folder.path,
+                 'latest_date': checkpoint.latest_date}
+                for checkpoint in cls.query.options(joinedload(cls.folder))]
+
+    def unique_fields(self):
+        return ["folder_id"]
+
+
+class MessageBody(db.Model, BaseMixin):
+    id = db.Column(db.Integer, primary_key=True)
+    header_message_id = db.Column(db.String, unique=True, nullable=False)
+    # zlib compressed body as returned by thunderbridge
+    body = db.Column(db.LargeBinary, nullable=False)
+    size = db.Column(db.Integer, nullable=False)  # Compressed bytes
+    raw_size = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.Float, nullable=False)  # Unix timestamp
+    last_used_at = db.Column(db.Float, nullable=False)  # Unix timestamp
+
+    def unique_fields(self):
+        return ["header_message_id"]
+
+
+class SectionMembership(db.Model, BaseMixin):
+    """Which messages belong to which section, kept up to date on ingest."""
+    section = db.Column(db.String, primary_key=True)
+    message_id = db.Column(db.Integer, db.ForeignKey(
+        'message.id'), primary_key=True)
+    # Copied from the message so listings never touch the message table to sort
+    date = db.Column(db.Integer, nullable=False)
+    read = db.Column(db.Boolean, default=False)
+    flagged = db.Column(db.Boolean, default=False)
+
+    def unique_fields(self):
+        return ["section", "message_id"]
+
+
+class SectionState(db.Model, BaseMixin):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String, unique=True, nullable=False)
+    # Hash of the section definition the membership rows were built from
+    fingerprint = db.Column(db.String, nullable=False)
+    built_at = db.Column(db.Float, nullable=False)  # Unix timestamp
+
+    def unique_fields(self):
+        return ["name"]
+
+
+class DataVersion(db.Model, BaseMixin):
+    """Single row counting the writes that change what listings show, for HTTP validators."""
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.Float, nullable=False)  # Unix timestamp
+
+    @classmethod
+    def bump(cls):
+        """Count a change of messages, summaries or section membership, within the caller's transaction."""
+        stmt = sqlite_insert(cls).values(id=1, version=1, updated_at=time.time())
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=[cls.id],
+            set_={'version': cls.version + 1, 'updated_at': stmt.excluded.updated_at}))
+
+    @classmethod
+    def current(cls):
+        """:return: tuple (version, updated_at), (0, None) before the first change"""
+        row = db.session.query(cls.version, cls.updated_at).filter(cls.id == 1).first()
+        return tuple(row) if row else (0, None)
+
+    def unique_fields(self):
+        return ["id"]
+
+
+class SectionCount(db.Model, BaseMixin):
+    """Message counters of a section, adjusted whenever its membership changes."""
+    id = db.Column(db.Integer, primary_key=True)
+    section = db.Column(db.String, unique=True, nullable=False)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    unread = db.Column(db.Integer, nullable=False, default=0)
+    flagged = db.Column(db.Integer, nullable=False, default=0)
+
+    def unique_fields(self):
+        return ["section"]
+
+
 class Recipient(db.Model, BaseMixin):
     id = db.Column(db.Integer, primary_key=True)
     message_id = db.Column(db.Integer, db.ForeignKey(
@@ -279,8 +795,225 @@ class Tag(db.Model, BaseMixin):
     def unique_fields(self):
         return ["message_id", "tag"]
 
+# Full-text search
+
+# FTS5 table over messages, rowid is the message id. The trigram tokenizer
+# answers substring LIKE queries from the index, so section filters keep
+# their ilike semantics without scanning the message table.
+search_table = table('message_search', column('rowid'), column('subject'),
+                     column('author_name'), column('author_email'),
+                     column('domain_rev'), column('summary'))
+SEARCH_COLUMNS = ['subject', 'author_name', 'author_email', 'domain_rev', 'summary']
+# bm25 weights of the columns above, a subject hit counts most
+SEARCH_WEIGHTS = [10.0, 5.0, 5.0, 1.0, 2.0]
+SEARCH_REINDEX_BATCH = 500
+
+# False if this SQLite build has no FTS5 trigram tokenizer (before 3.34)
+search_index_available = False
+
+
+def reverse_domain(email):
+    """'news@mail.example.com' -> 'com.example.mail', so domains group by their suffix."""
+    if not email or '@' not in email:
+        return ''
+    return '.'.join(reversed(email.rsplit('@', 1)[1].lower().split('.')))
+
+
+def create_search_index():
+    global search_index_available
+    try:
+        db.session.execute(text(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS message_search "
+            f"USING fts5({', '.join(SEARCH_COLUMNS)}, tokenize='trigram')"))
+        db.session.commit()
+    except OperationalError as e:
+        db.session.rollback()
+        print(f"Full-text search is unavailable, section filters will scan messages: {e}")
+        search_index_available = False
+        return
+    search_index_available = True
+    # Also catches up on an index that went stale when writing to it failed
+    indexed = db.session.execute(text("SELECT count(*) FROM message_search")).scalar()
+    if indexed != Message.query.count():
+        print("Building the full-text search index")
+        rebuild_search_index()
+
+
+def index_messages(message_ids):
+    """Refresh the search rows of the given messages, within the caller's transaction.
+
+    If the index cannot be written, search is turned off like it is for SQLite
+    builds without FTS5, and the caller's writes are kept.
+    """
+    global search_index_available
+    if not search_index_available or not message_ids:
+        return
+    try:
+        with db.session.begin_nested():
+            write_search_rows(list(message_ids))
+    except OperationalError as e:
+        print(f"Failed to update the full-text search index, turning search off: {e}")
+        search_index_available = False
+
+
+def write_search_rows(message_ids):
+    for start in range(0, len(message_ids), SEARCH_REINDEX_BATCH):
+        batch = message_ids[start:start + SEARCH_REINDEX_BATCH]
+        rows = (db.session.query(Message.id, Message.subject, Message.author_name,
+                                 Message.author_email, MessageSummary.summary)
+                .outerjoin(MessageSummary, MessageSummary.message_id == Message.id)
+                .filter(Message.id.in_(batch))
+                .all())
+        db.session.execute(delete(search_table).where(search_table.c.rowid.in_(batch)))
+        if rows:
+            db.session.execute(insert(search_table), [{
+                'rowid': message_id,
+                'subject': subject or '',
+                'author_name': author_name or '',
+                'author_email': author_email or '',
+                'domain_rev': reverse_domain(author_email),
+                'summary': summary or '',
+            } for message_id, subject, author_name, author_email, summary in rows])
+
+
+def rebuild_search_index():
+    db.session.execute(delete(search_table))
+    message_ids = [message_id for (message_id,) in db.session.query(Message.id)]
+    index_messages(message_ids)
+    db.session.commit()
+
+
+def search_ids(column_name, pattern):
+    """Subquery of message ids whose indexed column matches a LIKE pattern."""
+    return select(search_table.c.rowid).where(search_table.c[column_name].like(pattern))
+
+
+def search_messages(query, limit):
+    """Messages matching a free text query, best bm25 rank first.
+
+    :return: list of (Message, rank) tuples
+    """
+    phrase = '"' + query.replace('"', '""') + '"'
+    weights = ', '.join(str(weight) for weight in SEARCH_WEIGHTS)
+    ranked = db.session.execute(text(
+        f"SELECT rowid, bm25(message_search, {weights}) AS rank FROM message_search "
+        f"WHERE message_search MATCH :phrase ORDER BY rank LIMIT :limit"),
+        {'phrase': phrase, 'limit': limit}).all()
+    ranks = {message_id: rank for message_id, rank in ranked}
+    messages = (db.session.query(Message)
+                .options(*Message.listing_options())
+                .filter(Message.id.in_(ranks.keys()))
+                .all())
+    return sorted(((message, ranks[message.id]) for message in messages), key=lambda item: item[1])
+
+# Section membership
+
+# Section name -> condition checking a handful of known messages, registered
+# by SectionRegistry.sync. Unlike the listing conditions these never go through
+# the search index, which would resolve every match to test a single page.
+membership_conditions = {}
+MEMBERSHIP_BATCH = 500
+
+
+def update_memberships(message_ids):
+    """Recompute the section membership of the given messages, within the caller's transaction.
+
+    Section counters are adjusted by the difference between the old and new rows.
+    """
+    if not membership_conditions or not message_ids:
+        return
+    message_ids = list(message_ids)
+    for start in range(0, len(message_ids), MEMBERSHIP_BATCH):
+        batch = message_ids[start:start + MEMBERSHIP_BATCH]
+        in_batch = SectionMembership.message_id.in_(batch)
+        before = membership_counts(in_batch)
+        db.session.execute(delete(SectionMembership).where(in_batch))
+        for name, condition in membership_conditions.items():
+            insert_memberships(name, and_(Message.id.in_(batch), condition))
+        after = membership_counts(in_batch)
+        for name in before.keys() | after.keys():
+            old = before.get(name, (0, 0, 0))
+            new = after.get(name, (0, 0, 0))
+            if old != new:
+                add_to_counts(name, *(n - o for n, o in zip(new, old)))
+
+
+def insert_memberships(name, condition):
+    members = select(literal(name), Message.id, Message.date, Message.read, Message.flagged)
+    db.session.execute(insert(SectionMembership).from_select(
+        ['section', 'message_id', 'date', 'read', 'flagged'], members.where(condition)))
+
+
+def membership_counts(condition):
+    """(total, unread, flagged) per section over the membership rows matching a condition."""
+    rows = db.session.execute(
+        select(SectionMembership.section, func.count(),
+               func.sum(case((SectionMembership.read, 0), else_=1)),
+               func.sum(case((SectionMembership.flagged, 1), else_=0)))
+        .where(condition)
+        .group_by(SectionMembership.section))
+    return {name: (total, unread, flagged) for name, total, unread, flagged in rows}
+
+
+def add_to_counts(name, total, unread, flagged):
+    stmt = sqlite_insert(SectionCount).values(
+        section=name, total=total, unread=unread, flagged=flagged)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=[SectionCount.section],
+        set_={'total': SectionCount.total + stmt.excluded.total,
+              'unread': SectionCount.unread + stmt.excluded.unread,
+              'flagged': SectionCount.flagged + stmt.excluded.flagged}))
+
+
+def rebuild_membership(name, condition, fingerprint):
+    """Refill one section from scratch and remember the definition it was built from."""
+    db.session.execute(delete(SectionMembership).where(SectionMembership.section == name))
+    db.session.execute(delete(SectionCount).where(SectionCount.section == name))
+    insert_memberships(name, condition)
+    add_to_counts(name, *membership_counts(SectionMembership.section == name).get(name, (0, 0, 0)))
+    now = time.time()
+    stmt = sqlite_insert(SectionState).values(name=name, fingerprint=fingerprint, built_at=now)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=[SectionState.name],
+        set_={'fingerprint': stmt.excluded.fingerprint, 'built_at': stmt.excluded.built_at}))
+    DataVersion.bump()
+
+
+def drop_memberships(names):
+    db.session.execute(delete(SectionMembership).where(SectionMembership.section.in_(names)))
+    db.session.execute(delete(SectionCount).where(SectionCount.section.in_(names)))
+    db.session.execute(delete(SectionState).where(SectionState.name.in_(names)))
+    DataVersion.bump()
+
+
+def sections_of(message_ids, sections):
+    """{message_id: [section, ...]} for the given messages, limited to the given sections."""
+    result = {}
+    rows = (db.session.query(SectionMembership.message_id, SectionMembership.section)
+            .filter(SectionMembership.message_id.in_(list(message_ids)),
+                    SectionMembership.section.in_(list(sections))))
+    for message_id, section in rows:
+        result.setdefault(message_id, []).append(section)
+    return result
+
+
+def section_counts():
+    """Counters of every section as {name: {'total', 'unread', 'flagged'}}."""
+    return {count.section: {'total': count.total, 'unread': count.unread, 'flagged': count.flagged}
+            for count in SectionCount.query}
+
+
 # Indexing
 
 
 Index('index_read_date', Message.date, Message.read)
 Index('index_flagged_date', Message.date, Message.flagged)
+Index('index_summary_job_state_priority', SummaryJob.state, SummaryJob.priority)
+Index('index_summary_cache_last_used', SummaryCacheEntry.last_used_at)
+Index('index_message_body_last_used', MessageBody.last_used_at)
+Index('index_section_membership_date', SectionMembership.section,
+      SectionMembership.date, SectionMembership.message_id)
+Index('index_section_membership_message', SectionMembership.message_id)
+Index('index_message_folder', Message.folder_id)
+Index('index_message_author_email', Message.author_email)
+Index('unique_message_summary_message', MessageSummary.message_id, unique=True)
@@ -0,0 +1,140 @@
+import re
+from functools import lru_cache
+from html.parser import HTMLParser
+
+from bs4 import BeautifulSoup
+
+try:
+    import lxml.etree
+    import lxml.html
+except ImportError:
+    lxml = None
+
+# Elements whose content is never shown as text
+SKIPPED_TAGS = {'script', 'style', 'head', 'title', 'template', 'noscript', 'svg'}
+# Elements that start a new line of text
+BLOCK_TAGS = {'address', 'article', 'aside', 'blockquote', 'br', 'dd', 'div', 'dl', 'dt',
+              'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hr', 'li',
+              'main', 'nav', 'ol', 'p', 'pre', 'section', 'table', 'td', 'th', 'tr', 'ul'}
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta',
+             'param', 'source', 'track', 'wbr'}
+HIDDEN_STYLE_RE = re.compile(r'display\s*:\s*none|visibility\s*:\s*hidden', re.IGNORECASE)
+WHITESPACE_RE = re.compile(r'[ \t\r\n\xa0]+')
+
+
+def is_hidden(attrs):
+    """Whether element attributes hide it, like the preheader text of newsletters."""
+    attrs = dict(attrs)
+    return 'hidden' in attrs or bool(HIDDEN_STYLE_RE.search(attrs.get('style') or ''))
+
+
+def collapse_whitespace(text):
+    # Replace sequences of whitespace characters with a single space or newline
+    def replacer(match):
+        # if the matched string contains a newline, replace with newline, otherwise replace with space
+        return '\n' if '\n' in match.group() else ' '
+
+    return WHITESPACE_RE.sub(replacer, text).strip()
+
+
+class TagStripper(HTMLParser):
+    """Streaming parser that keeps visible text and drops everything else."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        # Open elements, each with whether it hides its content
+        self.stack = []
+        self.hidden_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in BLOCK_TAGS:
+            self.parts.append('\n')
+        if tag in VOID_TAGS:
+            return
+        hides = tag in SKIPPED_TAGS or is_hidden(attrs)
+        self.stack.append((tag, hides))
+        if hides:
+            self.hidden_depth += 1
+
+    def handle_endtag(self, tag):
+        if tag in BLOCK_TAGS:
+            self.parts.append('\n')
+        # Close up to the matching element, tolerating unclosed ones like <p> or <td>
+        for idx in range(len(self.stack) - 1, -1, -1):
+            if self.stack[idx][0] == tag:
+                for _, hides in self.stack[idx:]:
+                    if hides:
+                        self.hidden_depth -= 1
+                del self.stack[idx:]
+                break
+
+    def handle_data(self, data):
+        if not self.hidden_depth:
+            self.parts.append(data)
+
+    def text(self):
+        return ''.join(self.parts)
+
+
+def stripper_to_text(html_content):
+    parser = TagStripper()
+    parser.feed(html_content)
+    parser.close()
+    return parser.text()
+
+
+def lxml_to_text(html_content):
+    if not html_content.strip():
+        return ''
+    try:
+        document = lxml.html.document_fromstring(html_content)
+    except (ValueError, lxml.etree.ParserError):
+        # e.g. an XML encoding declaration in a str, which lxml refuses to parse
+        return stripper_to_text(html_content)
+    hidden = document.xpath(
+        '//script|//style|//head|//title|//template|//noscript|//svg|//*[@hidden]|//*[@style]')
+    for element in hidden:
+        if element.tag in SKIPPED_TAGS or is_hidden(element.attrib):
+            element.drop_tree()
+    for element in document.iter(*BLOCK_TAGS):
+        element.tail = '\n' + (element.tail or '')
+        element.text = '\n' + (element.text or '')
+    return document.text_content()
+
+
+def bs4_to_text(html_content):
+    soup = BeautifulSoup(html_content, 'html.parser')
+    for element in soup.find_all(lambda tag: tag.name in SKIPPED_TAGS or is_hidden(tag.attrs)):
+        element.decompose()
+    for element in soup.find_all(BLOCK_TAGS):
+        element.insert_before('\n')
+        element.insert_after('\n')
+    return soup.get_text()
+
+
+BACKENDS = {
+    'lxml': lxml_to_text,
+    'stripper': stripper_to_text,
+    'bs4': bs4_to_text,
+}
+
+
+@lru_cache(maxsize=None)
+def resolve_backend(name):
+    """Pick the extraction function for a backend name, 'auto' prefers lxml if installed."""
+    if name == 'auto':
+        name = 'lxml' if lxml is not None else 'stripper'
+    if name == 'lxml' and lxml is None:
+        print("lxml is not installed, falling back to the stripper HTML backend")
+        name = 'stripper'
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown HTML backend '{name}', expected one of {', '.join(BACKENDS)} or auto")
+    return BACKENDS[name]
+
+
+def html_to_text(html_content, backend='auto'):
+    """Visible text of an HTML or plain text body, with whitespace collapsed."""
+    if not html_content:
+        return ''
+    return collapse_whitespace(resolve_backend(backend)(html_content))
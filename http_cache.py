@@ -0,0 +1,123 @@
+"""Conditional GETs, response compression and versioned static URLs.
+
+API responses carry a weak ETag made of the config version and the data
+version, and browsers revalidate them on every use: an unchanged listing is
+answered with 304 before it is queried or serialized. Static URLs carry a
+hash of the file, so those responses may be cached for a year.
+"""
+import functools
+import gzip
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+
+from flask import make_response, request
+from werkzeug.http import is_resource_modified
+
+import database
+import settings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Changes whenever config.yaml does, e.g. the sections and tabs listings are built from
+CONFIG_VERSION = hashlib.sha256(json.dumps(
+    settings.config, sort_keys=True, default=str).encode()).hexdigest()[:16]
+CONFIG_MODIFIED = os.path.getmtime(settings.CONFIG_PATH)
+
+STATIC_MAX_AGE = 365 * 24 * 3600
+COMPRESS_MIN_BYTES = 512
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'image/svg+xml')
+
+
+def validators(depends_on_data):
+    """:return: tuple (etag, last_modified) of the config and, if asked, the data version"""
+    etag = f'config-{CONFIG_VERSION}'
+    modified = CONFIG_MODIFIED
+    if depends_on_data:
+        version, updated_at = database.DataVersion.current()
+        etag += f'-data-{version}'
+        modified = max(modified, updated_at or 0)
+    return etag, datetime.fromtimestamp(int(modified), timezone.utc)
+
+
+def conditional(depends_on_data=True):
+    """Answer a GET with 304 while its validators match, without running the view.
+
+    :param depends_on_data: False for responses built from config.yaml alone
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            etag, last_modified = validators(depends_on_data)
+            if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+                response = make_response(view(*args, **kwargs))
+                # Errors are not worth revalidating
+                if response.status_code != 200:
+                    return response
+            else:
+                response = make_response('', 304)
+            response.set_etag(etag, weak=True)
+            response.last_modified = last_modified
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
+
+
+@functools.lru_cache(maxsize=256)
+def file_hash(path, mtime):
+    with open(path, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()[:12]
+
+
+def static_version(static_folder, filename):
+    """Hash of a static file for its URL, None if it does not exist."""
+    path = os.path.join(static_folder, filename)
+    try:
+        return file_hash(path, os.path.getmtime(path))
+    except OSError:
+        return None
+
+
+def cache_static(response, static_folder):
+    """Let browsers keep a static file for a year if it was requested by its current hash."""
+    version = request.args.get('v')
+    if response.status_code in (200, 304) and version and \
+            version == static_version(static_folder, request.view_args['filename']):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_MAX_AGE
+        response.cache_control.immutable = True
+    return response
+
+
+def compress(response):
+    """Brotli (if installed) or gzip encode a text response the client accepts."""
+    if (response.status_code != 200 or 'Content-Encoding' in response.headers
+            or not response.mimetype.startswith(COMPRESSIBLE_TYPES)):
+        return response
+    response.vary.add('Accept-Encoding')
+    if brotli and request.accept_encodings['br']:
+        encoding = 'br'
+    elif request.accept_encodings['gzip']:
+        encoding = 'gzip'
+    else:
+        return response
+    # Static files are passed through as file wrappers, read them into memory
+    response.direct_passthrough = False
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+    response.set_data(brotli.compress(data, quality=5) if encoding == 'br'
+                      else gzip.compress(data, compresslevel=6))
+    response.headers['Content-Encoding'] = encoding
+    # The encoded bytes differ, a strong ETag of the file would no longer hold
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
@@ -1,22 +1,151 @@
+import heapq
+import itertools
 import json
+import random
+import re
+import time
+from contextlib import contextmanager
 import requests
 from jsonschema import validate, ValidationError
-import eventlet.semaphore
+import eventlet.corolocal
+import eventlet.event
 
+import metrics
 import settings
 
-ollama_lock = eventlet.semaphore.Semaphore()
 
+class PrioritySlots:
+    """Semaphore that hands a freed slot to the waiter with the highest priority, FIFO among equals.
 
-def ollama(model, prompt):
-    with ollama_lock:
+    Jobs claimed ahead of a free slot wait here, so an interactive job must not
+    queue behind the background jobs that got there first.
+    """
+
+    def __init__(self, size):
+        self.free = size
+        # (-priority, arrival, event) of the green threads waiting for a slot
+        self.waiters = []
+        self.arrivals = itertools.count()
+
+    def acquire(self, priority=0):
+        if self.free and not self.waiters:
+            self.free -= 1
+            return
+        waiter = (-priority, next(self.arrivals), eventlet.event.Event())
+        heapq.heappush(self.waiters, waiter)
+        try:
+            waiter[2].wait()
+        except BaseException:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+                heapq.heapify(self.waiters)
+            else:
+                # The slot was handed over just before, pass it on
+                self.release()
+            raise
+
+    def release(self):
+        if self.waiters:
+            heapq.heappop(self.waiters)[2].send()
+        else:
+            self.free += 1
+
+
+ollama_lock = PrioritySlots(settings.OLLAMA_PARALLELISM)
+# Priority of the job generating in the running green thread
+current_job = eventlet.corolocal.local()
+
+stream_stats = {
+    'requests': 0,
+    'early_stops': 0,
+    'time_to_first_token_total': 0.0,
+    'tokens_generated': 0,
+    'tokens_saved_estimate': 0,
+    # Tokens generated after the JSON object in streams that ran to completion
+    'trailing_tokens_total': 0,
+    'trailing_samples': 0,
+}
+
+
+validation_stats = {
+    'requests': 0,
+    'succeeded': 0,
+    'generations': 0,
+    # Number of requests by generations used, e.g. {1: 120, 2: 3}
+    'generations_per_request': {},
+}
+
+# Cleared when the Ollama server rejects a JSON schema as `format`
+schema_format_supported = True
+
+
+def output_format(json_checks):
+    """The `format` parameter for a generation, per the `ollama_format` setting."""
+    if settings.OLLAMA_FORMAT == 'schema' and json_checks is not None and schema_format_supported:
+        return json_checks
+    if settings.OLLAMA_FORMAT in ('schema', 'json'):
+        return 'json'
+    return None
+
+
+def post_generate(model, prompt, json_checks, stream):
+    """POST to /api/generate, falling back to plain JSON mode if the schema is rejected."""
+    global schema_format_supported
+
+    def post(output):
+        payload = {
+            'model': model,
+            'prompt': prompt,
+            'stream': stream
+        }
+        if output is not None:
+            payload['format'] = output
+        return requests.post(f'{settings.OLLAMA_URL}/api/generate', json=payload, stream=stream)
+
+    output = output_format(json_checks)
+    response = post(output)
+    # Only a bad request about the format means this Ollama has no structured outputs,
+    # a busy or failing server must not turn them off for good
+    if (response.status_code == 400 and isinstance(output, dict)
+            and re.search(r'format|schema', response.text, re.IGNORECASE)):
+        print(f"Ollama rejected the JSON schema format, falling back to plain JSON: {response.text}")
+        response.close()
+        schema_format_supported = False
+        response = post('json')
+    return response
+
+
+@contextmanager
+def job_priority(priority):
+    """Let the generations of the enclosed code wait for a slot with this priority."""
+    previous = getattr(current_job, 'priority', 0)
+    current_job.priority = priority
+    try:
+        yield
+    finally:
+        current_job.priority = previous
+
+
+@contextmanager
+def generation_slot():
+    """Hold one of the Ollama slots, timing the wait for it and the generation."""
+    waiting_since = time.perf_counter()
+    ollama_lock.acquire(getattr(current_job, 'priority', 0))
+    started = time.perf_counter()
+    metrics.record_stage('ollama_slot_wait', started - waiting_since)
+    try:
+        yield
+    finally:
+        metrics.record_stage('generation', time.perf_counter() - started)
+        ollama_lock.release()
+
+
+def ollama(model, prompt, json_checks=None):
+    if settings.OLLAMA_STREAM:
+        return ollama_stream(model, prompt, json_checks)
+    with generation_slot():
         try:
-            response = requests.post('http://localhost:11434/api/generate',
-                                     json={
-                                         'model': model,
-                                         'prompt': prompt,
-                                         'stream': False
-                                     })
+            response = post_generate(model, prompt, json_checks, stream=False)
             # Check if the HTTP request was successful
             if response.status_code != 200:
                 return None, f"Failed to generate response. HTTP status: {response.status_code}. Message: {response.text}"
@@ -26,11 +155,152 @@ def ollama(model, prompt):
                 return None, "Unexpected response format. 'response' key missing."
             return json_data['response'], "Success"
         except requests.RequestException as e:
-            return None, "An error occurred during the request: {e}"
+            return None, f"An error occurred during the request: {e}"
         except Exception as e:
             return None, f"An unexpected error occurred: {e}"
 
 
+class JsonObjectScanner:
+    """Tracks brace balance of streamed text to find where JSON objects end."""
+
+    def __init__(self):
+        self.text = ''
+        self.start = None
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+
+    def feed(self, chunk):
+        """Append a chunk and return every complete top-level object it closes."""
+        objects = []
+        offset = len(self.text)
+        self.text += chunk
+        for idx, char in enumerate(chunk, start=offset):
+            if self.start is None:
+                if char == '{':
+                    self.start = idx
+                    self.depth = 1
+                continue
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char == '{':
+                self.depth += 1
+            elif char == '}':
+                self.depth -= 1
+                if self.depth == 0:
+                    objects.append((self.start, idx + 1))
+                    self.start = None
+        return objects
+
+
+def parse_valid_json(json_string, json_checks):
+    try:
+        parsed_json = json.loads(json_string)
+        if json_checks is not None:
+            validate(instance=parsed_json, schema=json_checks)
+        return parsed_json
+    except (ValueError, ValidationError):
+        return None
+
+
+def ollama_stream(model, prompt, json_checks=None):
+    """Stream a generation and cancel it once a complete, valid JSON object arrived.
+
+    Closing the connection makes Ollama stop generating, so chatter after the
+    closing brace costs nothing. An `ollama_stream_calibration_rate` share of requests
+    runs to completion to estimate how many tokens that chatter usually takes.
+    """
+    calibrating = random.random() < settings.OLLAMA_STREAM_CALIBRATION_RATE
+    with generation_slot():
+        started = time.perf_counter()
+        first_token_at = None
+        tokens = 0
+        tokens_at_object_end = None
+        result_text = None
+        done = None
+        scanner = JsonObjectScanner()
+        try:
+            response = post_generate(model, prompt, json_checks, stream=True)
+            with response:
+                if response.status_code != 200:
+                    return None, f"Failed to generate response. HTTP status: {response.status_code}. Message: {response.text}"
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if 'error' in chunk:
+                        return None, f"Generation failed: {chunk['error']}"
+                    token = chunk.get('response', '')
+                    if token:
+                        tokens += 1
+                        if first_token_at is None:
+                            first_token_at = time.perf_counter()
+                    if chunk.get('done'):
+                        done = chunk
+                        break
+                    if result_text is not None:
+                        continue
+                    for start, end in scanner.feed(token):
+                        if parse_valid_json(scanner.text[start:end], json_checks) is not None:
+                            result_text = scanner.text[:end]
+                            tokens_at_object_end = tokens
+                            break
+                    if result_text is not None and not calibrating:
+                        # Leaving the block closes the connection, which cancels the generation
+                        break
+        except requests.RequestException as e:
+            return None, f"An error occurred during the request: {e}"
+        except Exception as e:
+            return None, f"An unexpected error occurred: {e}"
+
+    stream_stats['requests'] += 1
+    stream_stats['tokens_generated'] += tokens
+    ttft = (first_token_at or time.perf_counter()) - started
+    stream_stats['time_to_first_token_total'] += ttft
+    stopped_early = done is None and result_text is not None
+    note = ""
+    if stopped_early:
+        stream_stats['early_stops'] += 1
+        note = ", stopped early"
+        if stream_stats['trailing_samples']:
+            saved = round(stream_stats['trailing_tokens_total'] / stream_stats['trailing_samples'])
+            stream_stats['tokens_saved_estimate'] += saved
+            note += f" saving ~{saved} tokens"
+    elif done is not None and tokens_at_object_end is not None:
+        generated = done.get('eval_count', tokens)
+        stream_stats['trailing_tokens_total'] += max(0, generated - tokens_at_object_end)
+        stream_stats['trailing_samples'] += 1
+    print(f"stream: first token after {ttft:.2f}s, {tokens} tokens{note}")
+
+    if result_text is None:
+        if done is None:
+            return None, "Stream ended before a complete response was received."
+        # No valid object, hand the full text to the regular extraction and validation
+        return scanner.text, "Success"
+    return result_text, "Success"
+
+
+def get_stream_stats():
+    requests_count = stream_stats['requests']
+    return {
+        'requests': requests_count,
+        'early_stops': stream_stats['early_stops'],
+        'average_time_to_first_token': (stream_stats['time_to_first_token_total'] / requests_count
+                                        if requests_count else 0.0),
+        'tokens_generated': stream_stats['tokens_generated'],
+        'tokens_saved_estimate': stream_stats['tokens_saved_estimate'],
+        'average_trailing_tokens': (stream_stats['trailing_tokens_total'] / stream_stats['trailing_samples']
+                                    if stream_stats['trailing_samples'] else None),
+    }
+
+
 def extract_json_string(text):
     if not isinstance(text, str):
         return None, "Provided text is not a string."
@@ -45,37 +315,70 @@ def extract_json_string(text):
     return text[start_idx:end_idx + 1], None
 
 
+def record_generations(generations, succeeded):
+    validation_stats['requests'] += 1
+    validation_stats['generations'] += generations
+    if succeeded:
+        validation_stats['succeeded'] += 1
+    per_request = validation_stats['generations_per_request']
+    per_request[generations] = per_request.get(generations, 0) + 1
+    metrics.GENERATIONS.observe(generations, outcome='valid' if succeeded else 'invalid')
+    metrics.annotate(generations=generations)
+
+
+def get_validation_stats():
+    requests_count = validation_stats['requests']
+    return {
+        'requests': requests_count,
+        'succeeded': validation_stats['succeeded'],
+        'average_generations': (validation_stats['generations'] / requests_count
+                                if requests_count else 0.0),
+        'generations_per_request': {str(generations): count for generations, count
+                                    in sorted(validation_stats['generations_per_request'].items())},
+    }
+
+
 def prompt_and_validate(prompt, prompting_function, json_checks, print_fn, max_retries=3):
-    for _ in range(max_retries):
+    for attempt in range(1, max_retries + 1):
         # Get the prompt result from the prompting function
         prompt_result, reason = prompting_function(prompt)
         if prompt_result is None:
             print_fn(reason)
             continue
         print_fn("from llm: " + prompt_result)
-        # Extract the JSON string from the result
-        json_string, reason = extract_json_string(prompt_result)
-        if json_string is None:
-            print_fn(reason)
-            continue
+        # Structured output is valid JSON as a whole, extraction is only a fallback
+        try:
+            parsed_json = json.loads(prompt_result)
+        except ValueError:
+            # Extract the JSON string from the result
+            json_string, reason = extract_json_string(prompt_result)
+            if json_string is None:
+                print_fn(reason)
+                continue
+            try:
+                # Attempt to transform the result into JSON
+                parsed_json = json.loads(json_string)
+            except ValueError as e:
+                print_fn(f"Data is not valid JSON! Reason: {e}")
+                continue
         try:
-            # Attempt to transform the result into JSON
-            parsed_json = json.loads(json_string)
             # Validate the JSON
             validate(instance=parsed_json, schema=json_checks)
             # prints the created ticket details
-            print_fn("valid result:\n" + json.dumps(parsed_json, indent=4))
+            print_fn(f"valid result after {attempt} generation(s):\n" + json.dumps(parsed_json, indent=4))
+            record_generations(attempt, True)
             return parsed_json, "Success"  # Return the valid JSON
         except ValidationError as e:
             # Handle issues related to JSON parsing
             print_fn(f"Data is invalid! Reason: {e.message}")
+    record_generations(max_retries, False)
     # If we've exceeded the max retries
     return None, "Exceeded maximum retries without obtaining a valid input."
 
 
 def llm(prompt, print_fn=print):
     def prompting_function(prompt):
-        return ollama(settings.MODEL_NAME, prompt)
+        return ollama(settings.MODEL_NAME, prompt, settings.FIELD_CHECKS)
     return prompt_and_validate(prompt,
                                prompting_function,
                                settings.FIELD_CHECKS,
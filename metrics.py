@@ -0,0 +1,227 @@
+"""Timings of the summarization pipeline and the web routes in Prometheus text format.
+
+Measurements are collected in histograms and counters that /metrics renders.
+Code running inside a scope (a summarization job or an HTTP request) also adds
+its stage timings and SQL query count to that scope, and finished jobs are
+appended as JSON lines to `metrics_trace_log` if it is set.
+"""
+import bisect
+import json
+import time
+from contextlib import contextmanager
+
+import eventlet.corolocal
+
+import settings
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+registry = []
+
+# Scope of the running green thread, threading.local may predate eventlet's monkey patching
+current = eventlet.corolocal.local()
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in pairs) + '}'
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        # Label values -> value of the series
+        self.series = {}
+        registry.append(self)
+
+    def key(self, labels):
+        return tuple(labels[name] for name in self.labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.kind}']
+        for values, value in sorted(self.series.items()):
+            lines.extend(self.render_series(values, value))
+        return lines
+
+    def render_series(self, values, value):
+        return [f'{self.name}{format_labels(self.labels, values)} {format_number(value)}']
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        self.series[key] = self.series.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        self.series[self.key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, description, buckets, labels=()):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        series = self.series.get(key)
+        if series is None:
+            # Observations per bucket (the last one is +Inf), sum and count
+            series = self.series[key] = [[0] * (len(self.buckets) + 1), 0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render_series(self, values, series):
+        counts, total, count = series
+        lines = []
+        cumulative = 0
+        for bound, observations in zip(self.buckets + ('+Inf',), counts):
+            cumulative += observations
+            lines.append(f'{self.name}_bucket{format_labels(self.labels, values, [("le", bound)])} {cumulative}')
+        lines.append(f'{self.name}_sum{format_labels(self.labels, values)} {format_number(total)}')
+        lines.append(f'{self.name}_count{format_labels(self.labels, values)} {count}')
+        return lines
+
+
+JOB_STAGE_SECONDS = Histogram(
+    'tldr_job_stage_seconds', 'Time summarization jobs spent per stage', SECONDS_BUCKETS, ['stage'])
+JOBS = Counter('tldr_jobs_total', 'Finished summarization job attempts', ['outcome'])
+PROMPT_TOKENS = Histogram('tldr_prompt_tokens', 'Estimated tokens per summarization prompt', TOKEN_BUCKETS)
+GENERATIONS = Histogram(
+    'tldr_generations_per_summary', 'Generations needed for a valid summary, more than one are retries',
+    COUNT_BUCKETS, ['outcome'])
+HTTP_REQUEST_SECONDS = Histogram(
+    'tldr_http_request_seconds', 'HTTP request latency per route', SECONDS_BUCKETS,
+    ['method', 'route', 'status'])
+HTTP_REQUEST_QUERIES = Histogram(
+    'tldr_http_request_queries', 'SQL queries per HTTP request', COUNT_BUCKETS, ['method', 'route'])
+SQL_QUERIES = Counter('tldr_sql_queries_total', 'SQL statements executed', ['scope'])
+JOB_QUEUE = Gauge('tldr_summary_jobs', 'Summarization jobs by state', ['state'])
+WORKERS_BUSY = Gauge('tldr_workers_busy', 'Worker slots handling a job')
+
+
+class Scope:
+    """What happened during one job or request, stage seconds are summed over repeats."""
+
+    def __init__(self, kind, **fields):
+        self.kind = kind
+        self.fields = fields
+        self.stages = {}
+        self.queries = 0
+        self.started = time.perf_counter()
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+@contextmanager
+def scope(kind, **fields):
+    previous = getattr(current, 'scope', None)
+    current.scope = Scope(kind, **fields)
+    try:
+        yield current.scope
+    finally:
+        current.scope = previous
+
+
+def current_scope():
+    return getattr(current, 'scope', None)
+
+
+def record_stage(stage, seconds):
+    """Observe a job stage, and add it to the trace of the running job."""
+    JOB_STAGE_SECONDS.observe(seconds, stage=stage)
+    active = current_scope()
+    if active:
+        active.stages[stage] = active.stages.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def timed(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started)
+
+
+def annotate(**fields):
+    """Add fields such as the prompt size to the trace of the running job."""
+    active = current_scope()
+    if active:
+        active.fields.update(fields)
+
+
+def count_query():
+    active = current_scope()
+    SQL_QUERIES.inc(scope=active.kind if active else 'other')
+    if active:
+        active.queries += 1
+
+
+@contextmanager
+def job_trace(job_id, header_message_id, attempt):
+    """Scope of one job attempt, set `outcome` on the yielded scope before leaving."""
+    with scope('job', job_id=job_id, header_message_id=header_message_id, attempt=attempt) as trace:
+        trace.outcome = 'error'
+        try:
+            yield trace
+        finally:
+            record_stage('total', trace.elapsed())
+            JOBS.inc(outcome=trace.outcome)
+            if settings.METRICS_TRACE_LOG:
+                write_trace(trace)
+
+
+def write_trace(trace):
+    entry = dict(trace.fields, outcome=trace.outcome, finished_at=time.time(), queries=trace.queries,
+                 stages={stage: round(seconds, 6) for stage, seconds in trace.stages.items()})
+    try:
+        with open(settings.METRICS_TRACE_LOG, 'a') as file:
+            file.write(json.dumps(entry) + '\n')
+    except OSError as e:
+        print(f"Failed to write job trace: {e}")
+
+
+def begin_request():
+    current.scope = Scope('http')
+
+
+def end_request(method, route, status):
+    active = current_scope()
+    current.scope = None
+    if not active or active.kind != 'http':
+        return
+    HTTP_REQUEST_SECONDS.observe(active.elapsed(), method=method, route=route, status=status)
+    HTTP_REQUEST_QUERIES.observe(active.queries, method=method, route=route)
+
+
+def render():
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
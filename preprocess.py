@@ -0,0 +1,76 @@
+"""Email preprocessing in worker processes.
+
+Eventlet runs everything in one OS thread, so parsing a heavy HTML body would
+block the socket.io loop. Worker processes speak JSON lines over their stdin
+and stdout, which green pipes can wait on without blocking. The standard
+multiprocessing pools rely on threads and do not survive monkey patching.
+"""
+import importlib
+import json
+import sys
+
+import eventlet.queue
+from eventlet.green import subprocess
+
+
+class ProcessPool:
+    """Calls `module:function` in `size` long-lived worker processes."""
+
+    def __init__(self, size, target):
+        self.size = size
+        self.target = target
+        self.idle = None
+
+    def _spawn(self):
+        return subprocess.Popen([sys.executable, '-m', 'preprocess', self.target],
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                text=True, bufsize=1)
+
+    def _start(self):
+        self.idle = eventlet.queue.LightQueue()
+        for _ in range(self.size):
+            self.idle.put(self._spawn())
+
+    def call(self, argument):
+        """Run the target on a JSON serializable argument in the next idle process.
+
+        :return: tuple (result, reason), result is None on failure
+        """
+        if self.idle is None:
+            self._start()
+        process = self.idle.get()
+        try:
+            process.stdin.write(json.dumps(argument) + '\n')
+            process.stdin.flush()
+            line = process.stdout.readline()
+        except OSError as e:
+            line = ''
+            print(f"Preprocessing process failed: {e}")
+        if not line:
+            process.kill()
+            self.idle.put(self._spawn())
+            return None, "Preprocessing process exited unexpectedly"
+        self.idle.put(process)
+        response = json.loads(line)
+        if 'error' in response:
+            return None, f"Preprocessing failed: {response['error']}"
+        return response['result'], "Success"
+
+
+def serve(target):
+    module_name, function_name = target.split(':')
+    function = getattr(importlib.import_module(module_name), function_name)
+    # Keep stdout for responses, anything printed by the target goes to stderr
+    responses = sys.stdout
+    sys.stdout = sys.stderr
+    for line in sys.stdin:
+        try:
+            response = {'result': function(json.loads(line))}
+        except Exception as e:
+            response = {'error': f"{type(e).__name__}: {e}"}
+        responses.write(json.dumps(response) + '\n')
+        responses.flush()
+
+
+if __name__ == '__main__':
+    serve(sys.argv[1])
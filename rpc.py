@@ -0,0 +1,139 @@
+"""Request/response calls to socket.io clients.
+
+Every call gets its own request id and future, is routed to the least busy
+healthy client and is abandoned at its deadline. Responses arrive through
+socket.io acknowledgements, so concurrent calls never see each other's data.
+"""
+import itertools
+import time
+
+import eventlet.event
+import eventlet.semaphore
+import eventlet.timeout
+
+# Sent to the futures of a client that went away, so callers don't wait out their deadline
+DISCONNECTED = object()
+
+
+class RpcClient:
+    def __init__(self, sid, max_in_flight):
+        self.sid = sid
+        self.slots = eventlet.semaphore.Semaphore(max_in_flight)
+        # Request id -> future of the calls waiting on this client
+        self.pending = {}
+        # Calls waiting for a free slot
+        self.queued = 0
+        # Consecutive calls that ran into their deadline
+        self.failures = 0
+        self.unhealthy_until = 0.0
+
+    def healthy(self, now):
+        return self.unhealthy_until <= now
+
+    def load(self):
+        return len(self.pending) + self.queued
+
+
+class RpcPool:
+    """Calls an event on one of the registered clients and waits for its answer.
+
+    :param emit: function(event, message, sid, callback) sending an event to a client
+    :param max_in_flight: Calls a single client works on at once, later ones wait for a slot
+    :param timeout: Default seconds a call may take, including the wait for a slot
+    :param failure_threshold: Consecutive timeouts after which a client is skipped for `cooldown` seconds
+    """
+
+    def __init__(self, emit, max_in_flight=8, timeout=10, failure_threshold=3, cooldown=30):
+        self.emit = emit
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.clients = {}
+        self.request_ids = itertools.count(1)
+        self.stats = {'calls': 0, 'timeouts': 0, 'disconnects': 0}
+
+    def add(self, sid):
+        if sid not in self.clients:
+            self.clients[sid] = RpcClient(sid, self.max_in_flight)
+
+    def remove(self, sid):
+        client = self.clients.pop(sid, None)
+        if client:
+            pending = list(client.pending.values())
+            # Acks arriving after the disconnect find nothing to answer
+            client.pending.clear()
+            for future in pending:
+                # An ack may have landed just before the disconnect
+                if not future.ready():
+                    future.send(DISCONNECTED)
+
+    def __contains__(self, sid):
+        return sid in self.clients
+
+    def pick(self):
+        """Least busy client, preferring the ones that answered recently."""
+        if not self.clients:
+            return None
+        now = time.monotonic()
+        clients = list(self.clients.values())
+        candidates = [client for client in clients if client.healthy(now)] or clients
+        return min(candidates, key=RpcClient.load)
+
+    def call(self, event, message, timeout=None):
+        """Send an event to one client and wait for its acknowledgement.
+
+        :param timeout: Deadline of this call in seconds, the pool default if None
+        :return: tuple (response, reason), response is None on failure
+        """
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        client = self.pick()
+        if client is None:
+            return None, "No clients connected"
+        client.queued += 1
+        acquired = client.slots.acquire(timeout=timeout)
+        client.queued -= 1
+        if not acquired:
+            return None, f"Client {client.sid} is busy with {len(client.pending)} calls"
+        if self.clients.get(client.sid) is not client:
+            client.slots.release()
+            return None, f"Client {client.sid} disconnected before request '{event}' was sent"
+        request_id = next(self.request_ids)
+        future = eventlet.event.Event()
+        client.pending[request_id] = future
+        self.stats['calls'] += 1
+
+        def on_response(*args):
+            # Late answers to abandoned calls are dropped
+            if client.pending.get(request_id) is future and not future.ready():
+                future.send(args[0] if args else None)
+
+        try:
+            self.emit(event, message, client.sid, on_response)
+            with eventlet.timeout.Timeout(max(deadline - time.monotonic(), 0), False):
+                response = future.wait()
+            if not future.ready():
+                self.stats['timeouts'] += 1
+                client.failures += 1
+                if client.failures >= self.failure_threshold:
+                    client.unhealthy_until = time.monotonic() + self.cooldown
+                return None, f"Request {request_id} '{event}' to {client.sid} timed out after {timeout}s"
+            if response is DISCONNECTED:
+                self.stats['disconnects'] += 1
+                return None, f"Client {client.sid} disconnected during request {request_id} '{event}'"
+            client.failures = 0
+            client.unhealthy_until = 0.0
+            return response, "Success"
+        finally:
+            client.pending.pop(request_id, None)
+            client.slots.release()
+
+    def get_stats(self):
+        now = time.monotonic()
+        return dict(self.stats, clients=[{
+            'sid': client.sid,
+            'in_flight': len(client.pending),
+            'queued': client.queued,
+            'healthy': client.healthy(now),
+        } for client in self.clients.values()])
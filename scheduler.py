@@ -0,0 +1,84 @@
+"""Decides which emails get summarized before anyone asks for them.
+
+New messages are enqueued on ingest, newest first, with a boost for the
+sections a frontend shows. Cards in a frontend's viewport are raised to the
+interactive priority and fall back to their background priority once they
+scroll out of view.
+"""
+import time
+
+import database
+import settings
+
+# Frontend sid -> header ids of the cards it last reported as visible
+viewports = {}
+
+
+def background_priority(date, now, shown):
+    """Hours left until the message leaves the auto summarize window, plus the shown section boost."""
+    age_hours = max(now - date, 0) / 3600
+    priority = max(int(settings.AUTO_SUMMARIZE_MAX_AGE_DAYS * 24 - age_hours), 0)
+    return priority + (settings.SHOWN_SECTION_BOOST if shown else 0)
+
+
+def background_priorities(messages, shown_sections):
+    """:param messages: list of (id, header_message_id, date) tuples"""
+    now = time.time()
+    shown = database.sections_of((message_id for message_id, _, _ in messages), shown_sections) \
+        if shown_sections else {}
+    return {header_message_id: background_priority(date, now, message_id in shown)
+            for message_id, header_message_id, date in messages}
+
+
+def unsummarized(header_message_ids, *conditions):
+    """(id, header_message_id, date) of the given messages that have no summary yet."""
+    return (database.db.session.query(database.Message.id, database.Message.header_message_id,
+                                      database.Message.date)
+            .outerjoin(database.MessageSummary,
+                       database.MessageSummary.message_id == database.Message.id)
+            .filter(database.Message.header_message_id.in_(list(header_message_ids)),
+                    database.MessageSummary.id.is_(None), *conditions)
+            .all())
+
+
+def enqueue_ingested(header_message_ids, shown_sections):
+    """Enqueue the unsummarized messages of an ingest that are recent enough.
+
+    :return: number of jobs enqueued
+    """
+    if not settings.AUTO_SUMMARIZE_MAX_AGE_DAYS or not header_message_ids:
+        return 0
+    cutoff = time.time() - settings.AUTO_SUMMARIZE_MAX_AGE_DAYS * 86400
+    messages = unsummarized(header_message_ids, database.Message.date >= cutoff)
+    database.SummaryJob.enqueue_many(background_priorities(messages, shown_sections))
+    return len(messages)
+
+
+def update_viewport(sid, visible_ids, interactive_priority, shown_sections):
+    """Raise the cards now in view and lower the pending ones that scrolled away.
+
+    :return: number of cards that entered or left the view
+    """
+    visible = set(visible_ids[:settings.VIEWPORT_MAX_CARDS])
+    previous = viewports.get(sid, set())
+    viewports[sid] = visible
+    # Another frontend may still show a card this one scrolled away from
+    still_visible = set().union(*viewports.values())
+    left = previous - still_visible
+    entered = visible - previous
+    if entered:
+        database.SummaryJob.enqueue_many({header_message_id: interactive_priority
+                                          for _, header_message_id, _ in unsummarized(entered)})
+    if left:
+        messages = (database.db.session.query(database.Message.id, database.Message.header_message_id,
+                                              database.Message.date)
+                    .filter(database.Message.header_message_id.in_(list(left)))
+                    .all())
+        database.SummaryJob.reprioritize(background_priorities(messages, shown_sections))
+    return len(entered) + len(left)
+
+
+def forget(sid, shown_sections):
+    """Drop a frontend that went away, its cards are no longer in view."""
+    update_viewport(sid, [], None, shown_sections)
+    viewports.pop(sid, None)
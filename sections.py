@@ -0,0 +1,230 @@
+import hashlib
+import json
+
+from sqlalchemy import and_, func, or_, select, true, tuple_
+
+import database
+
+
+class SectionConfigError(ValueError):
+    pass
+
+
+# Bumped when filters start matching differently, so stored memberships are rebuilt
+MATCHING_VERSION = 2
+
+FILTER_TYPES = {'sender_domain', 'sender_email',
+                'subject_contains', 'sender_name_contains'}
+
+
+def compile_filter(filter_def, use_search_index=True):
+    """SQL condition of a single filter.
+
+    :param use_search_index: Resolve substring filters through the full-text index,
+        which pays off when matching the whole mailbox but not a handful of messages
+    """
+    use_search_index = use_search_index and database.search_index_available
+    value = filter_def['value']
+    if filter_def['type'] == 'sender_domain':
+        if use_search_index:
+            return database.Message.id.in_(database.search_ids(
+                'domain_rev', database.reverse_domain(f"@{value}")))
+        return func.coalesce(database.Message.author_email, '').ilike(f"%@{value}")
+    if filter_def['type'] == 'sender_email':
+        return database.Message.author_email == value
+    if filter_def['type'] == 'subject_contains':
+        if use_search_index:
+            return database.Message.id.in_(database.search_ids('subject', f"%{value}%"))
+        # NULL counts as '', like in the search index, so an exclude keeps the message
+        return func.coalesce(database.Message.subject, '').ilike(f"%{value}%")
+    if filter_def['type'] == 'sender_name_contains':
+        if use_search_index:
+            return database.Message.id.in_(database.search_ids('author_name', f"%{value}%"))
+        return func.coalesce(database.Message.author_name, '').ilike(f"%{value}%")
+    raise SectionConfigError(f"Unknown filter type '{filter_def['type']}'")
+
+
+def all_of(conditions):
+    return and_(*conditions) if conditions else true()
+
+
+class CompiledSection:
+    def __init__(self, config, conditions, match_condition, descriptions, fingerprint):
+        self.config = config
+        self.name = config['name']
+        self.display_name = config.get('display_name', self.name)
+        # Conditions a message has to meet, all of them
+        self.conditions = conditions
+        self.condition = all_of(conditions)
+        # Same test without the search index, for checking a few known messages
+        self.match_condition = match_condition
+        # Human readable filter descriptions shown in the section header
+        self.descriptions = descriptions
+        # Changes whenever the messages matched by this section may change
+        self.fingerprint = fingerprint
+        # Reusable listing statement over the materialized membership,
+        # callers add pagination on top
+        membership = database.SectionMembership
+        self.query = (select(database.Message)
+                      .join(membership, membership.message_id == database.Message.id)
+                      .where(membership.section == self.name)
+                      .order_by(membership.date.desc(), membership.message_id.desc()))
+
+    @staticmethod
+    def after_cursor(cursor_position):
+        """Filter for listing rows after a decoded (date, id) cursor."""
+        membership = database.SectionMembership
+        return tuple_(membership.date, membership.message_id) < tuple_(*cursor_position)
+
+    def page(self, limit, cursor_position=None):
+        """One listing page with relationships eager loaded, as served by the emails route.
+
+        :param cursor_position: Decoded cursor of the previous page, None for the first page
+        :return: tuple (emails: list of dicts, next_cursor: str or None)
+        """
+        query = self.query
+        if cursor_position is not None:
+            query = query.where(self.after_cursor(cursor_position))
+        messages = database.db.session.scalars(query
+                                               .options(*database.Message.listing_options())
+                                               .limit(limit)).unique().all()
+        next_cursor = database.Message.encode_cursor(messages[-1]) if len(messages) == limit else None
+        return [message.to_dict(relationships=True, json_ready=True) for message in messages], next_cursor
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'display_name': self.display_name,
+            'filters': self.descriptions,
+        }
+
+
+class SectionRegistry:
+    """Sections and tabs from config.yaml, validated and compiled once."""
+
+    def __init__(self, sections_config, tabs_config):
+        self.configs = {}
+        for section_config in sections_config:
+            name = section_config.get('name')
+            if not name:
+                raise SectionConfigError(f"Section without a name: {section_config}")
+            if name in self.configs:
+                raise SectionConfigError(f"Duplicate section '{name}'")
+            self.configs[name] = section_config
+
+        self.sections = {}
+        for name in self.configs:
+            self._compile(name, [])
+
+        self.tabs = {}
+        for tab_config in tabs_config:
+            for section_name in tab_config.get('sections', []):
+                if section_name not in self.sections:
+                    raise SectionConfigError(
+                        f"Tab '{tab_config['name']}' refers to unknown section '{section_name}'")
+            self.tabs[tab_config['name']] = tab_config
+
+    def _compile(self, name, path):
+        if name in self.sections:
+            return self.sections[name]
+        if name in path:
+            cycle = ' -> '.join(path[path.index(name):] + [name])
+            raise SectionConfigError(f"Sections refer to each other in a cycle: {cycle}")
+        section_config = self.configs[name]
+        for key in ('and', 'or', 'exclude'):
+            for nested_name in section_config.get(key, []):
+                if nested_name not in self.configs:
+                    raise SectionConfigError(
+                        f"Section '{name}' refers to unknown section '{nested_name}' in '{key}'")
+        for filter_def in section_config.get('filters', []):
+            if filter_def.get('type') not in FILTER_TYPES:
+                raise SectionConfigError(
+                    f"Section '{name}' has unknown filter type '{filter_def.get('type')}'")
+
+        path = path + [name]
+
+        def nested(key):
+            return [self._compile(nested_name, path) for nested_name in section_config.get(key, [])]
+
+        and_sections = nested('and')
+        or_sections = nested('or')
+        exclude_sections = nested('exclude')
+
+        def combine(attribute, use_search_index):
+            conditions = [getattr(section, attribute) for section in and_sections]
+            conditions.extend(compile_filter(filter_def, use_search_index)
+                              for filter_def in section_config.get('filters', []))
+            if or_sections:
+                conditions.append(or_(*[getattr(section, attribute) for section in or_sections]))
+            conditions.extend(~getattr(section, attribute) for section in exclude_sections)
+            return conditions
+
+        definition = {
+            'matching': MATCHING_VERSION,
+            'filters': section_config.get('filters', []),
+            'and': [section.fingerprint for section in and_sections],
+            'or': [section.fingerprint for section in or_sections],
+            'exclude': [section.fingerprint for section in exclude_sections],
+        }
+        fingerprint = hashlib.sha1(json.dumps(definition, sort_keys=True).encode()).hexdigest()
+
+        compiled = CompiledSection(
+            section_config, combine('condition', True), all_of(combine('match_condition', False)),
+            self._describe(section_config, ''), fingerprint)
+        self.sections[name] = compiled
+        return compiled
+
+    def _describe(self, section_config, prefix):
+        filter_descriptions = []
+        and_filters = section_config.get('and', [])
+        or_filters = section_config.get('or', [])
+        not_filters = section_config.get('exclude', [])
+        simple_filters = section_config.get('filters', [])
+
+        for i, and_filter in enumerate(and_filters, start=1):
+            and_prefix = f'{prefix}AND[{i}] ' if len(
+                and_filters) > 1 else prefix
+            filter_descriptions.extend(
+                self._describe(self.configs[and_filter], and_prefix))
+
+        for i, or_filter in enumerate(or_filters, start=1):
+            or_prefix = f'{prefix}OR[{i}] ' if len(
+                or_filters) > 1 else prefix
+            filter_descriptions.extend(
+                self._describe(self.configs[or_filter], or_prefix))
+
+        for i, not_filter in enumerate(not_filters, start=1):
+            not_prefix = f'{prefix}NOT[{i}] '
+            filter_descriptions.extend(
+                self._describe(self.configs[not_filter], not_prefix))
+
+        and_prefix = 'AND' if len(simple_filters) > 1 else ''
+        for i, simple_filter in enumerate(simple_filters, start=1):
+            filter_str = f'{prefix}{and_prefix}[{i}] {simple_filter["type"]}: {simple_filter["value"]}' if and_prefix else f'{prefix}{simple_filter["type"]}: {simple_filter["value"]}'
+            filter_descriptions.append(filter_str)
+
+        return filter_descriptions
+
+    def sync(self):
+        """Rebuild the stored membership of sections whose definition changed
+        since the last run, and keep it up to date on ingest from now on."""
+        built = {state.name: state.fingerprint for state in database.SectionState.query}
+        counted = database.section_counts()
+        removed = [name for name in built if name not in self.sections]
+        if removed:
+            database.drop_memberships(removed)
+        for name, section in self.sections.items():
+            if built.get(name) != section.fingerprint or name not in counted:
+                print(f"Building membership of section '{name}'")
+                database.rebuild_membership(name, section.condition, section.fingerprint)
+        database.db.session.commit()
+        database.membership_conditions.clear()
+        database.membership_conditions.update(
+            (name, section.match_condition) for name, section in self.sections.items())
+
+    def tab_sections(self, tab_name):
+        """Compiled sections of a tab in display order, or None if there is no such tab."""
+        tab_config = self.tabs.get(tab_name)
+        if tab_config is None:
+            return None
+        return [self.sections[name] for name in tab_config.get('sections', [])]
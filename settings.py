@@ -1,6 +1,11 @@
+import os
+
 import yaml
 
-with open('config.yaml', 'r') as file:
+# Another config file can be picked for test runs, e.g. by benchmarks/load.py
+CONFIG_PATH = os.environ.get('TLDR_CONFIG', 'config.yaml')
+
+with open(CONFIG_PATH, 'r') as file:
     config = yaml.safe_load(file)
 
 MODEL_NAME = config['model_name']
@@ -8,3 +13,36 @@ FIELD_CHECKS = config['field_checks']
 MAX_RETRIES = config['max_retries']
 SECTIONS = config['sections']
 TABS = config['tabs']
+OLLAMA_URL = config.get('ollama_url', 'http://localhost:11434')
+OLLAMA_PARALLELISM = config.get('ollama_parallelism', 1)
+OLLAMA_STREAM = config.get('ollama_stream', True)
+OLLAMA_FORMAT = config.get('ollama_format', 'schema')
+OLLAMA_STREAM_CALIBRATION_RATE = config.get('ollama_stream_calibration_rate', 0.05)
+INTERACTIVE_SHARE = config.get('interactive_share', 3)
+JOB_MAX_ATTEMPTS = config.get('job_max_attempts', 3)
+JOB_RETRY_DELAY = config.get('job_retry_delay', 30)
+JOB_PRIORITY_AGING_PER_HOUR = config.get('job_priority_aging_per_hour', 1.0)
+HTML_BACKEND = config.get('html_backend', 'auto')
+PROMPT_TOKEN_BUDGET = config.get('prompt_token_budget', 2048)
+PROMPT_HEAD_RATIO = config.get('prompt_head_ratio', 0.75)
+SUMMARY_CACHE_SIZE = config.get('summary_cache_size', 5000)
+PREPROCESS_PROCESSES = config.get('preprocess_processes', 2)
+PREPROCESS_AHEAD = config.get('preprocess_ahead', 2)
+BODY_CACHE_SIZE_MB = config.get('body_cache_size_mb', 256)
+BODY_PREFETCH = config.get('body_prefetch', 10)
+BODY_BATCH_SIZE = config.get('body_batch_size', 5)
+RPC_TIMEOUT = config.get('rpc_timeout', 10)
+RPC_MAX_IN_FLIGHT = config.get('rpc_max_in_flight', 8)
+SYNC_OVERLAP_SECONDS = config.get('sync_overlap_seconds', 86400)
+AUTO_SUMMARIZE_MAX_AGE_DAYS = config.get('auto_summarize_max_age_days', 30)
+SHOWN_SECTION_BOOST = config.get('shown_section_boost', 1000)
+VIEWPORT_MAX_CARDS = config.get('viewport_max_cards', 50)
+DATABASE_URI = config.get('database_uri', 'sqlite:///' + os.path.join(
+    os.path.expanduser('~'), '.llm-mail-summarizer', 'database.db'))
+DATABASE_POOL_SIZE = config.get('database_pool_size', 10)
+SQLITE_JOURNAL_MODE = config.get('sqlite_journal_mode', 'wal')
+SQLITE_SYNCHRONOUS = config.get('sqlite_synchronous', 'normal')
+SQLITE_MMAP_SIZE_MB = config.get('sqlite_mmap_size_mb', 256)
+SQLITE_CACHE_SIZE_MB = config.get('sqlite_cache_size_mb', 64)
+SQLITE_BUSY_TIMEOUT_MS = config.get('sqlite_busy_timeout_ms', 5000)
+METRICS_TRACE_LOG = config.get('metrics_trace_log', None)
@@ -1,6 +1,7 @@
 const CHANCE_TRESHOLD = 0.3
 const NEAR_BOTTOM_THRESHOLD = 1000
 const PAGE_SIZE = 30;
+const VIEWPORT_HINT_INTERVAL = 250;
 
 const AnimationType = {
     SWIPE_LEFT: 'card-removal-swipe-left',
@@ -48,6 +49,21 @@ function openEmail(message) {
         });
 }
 
+// Tab and sections shown, renewed with the server after every reconnect
+let subscription = null;
+
+// Section name -> {total, unread, flagged}, kept current by 'section-counts' pushes
+const sectionCounts = {};
+
+function renderSectionCounts() {
+    document.querySelectorAll('.section-count').forEach(badge => {
+        const counts = sectionCounts[badge.dataset.section];
+        if (counts) {
+            badge.textContent = counts.unread ? `${counts.unread} / ${counts.total}` : `${counts.total}`;
+        }
+    });
+}
+
 // Throttle function to limit the number of calls to the scroll handler
 function throttle(func, limit) {
     let inThrottle;
@@ -83,16 +99,17 @@ async function onNearBottom(func) {
 
 document.addEventListener("DOMContentLoaded", async () => {
     let isLoading = false;
-    let lastEmailDate = null; // This will be updated with the date of the last email on the page
+    let nextCursor = null; // Cursor of the next page, returned with every page of emails
     let reachedEnd = false;
     let currentSectionIndex = 0; // New variable to track the current section index
     let sections = []; // New variable to hold the sections
     let tab = "general";
+    const messagesById = {}; // Messages shown as cards, by header message id
 
     const emailContainer = document.getElementById("emailContainer");
-    const cardTemplateFuture = await fetch('/static/templates/cardTemplate.html');
+    const cardTemplateFuture = await fetch(document.body.dataset.cardTemplate);
     const cardTemplate = await cardTemplateFuture.text();
-    const sectionTemplateFuture = await fetch('/static/templates/sectionTemplate.html');
+    const sectionTemplateFuture = await fetch(document.body.dataset.sectionTemplate);
     const sectionTemplate = await sectionTemplateFuture.text();
 
     async function appendSection(section) {
@@ -101,8 +118,10 @@ document.addEventListener("DOMContentLoaded", async () => {
         }
         let emailSectionHtml = sectionTemplate
             .replace('{{display_name}}', section.display_name)
+            .replace('{{name}}', section.name)
             .replace('{{filters}}', generateFiltersHtml(section.filters));
         emailContainer.insertAdjacentHTML('beforeend', emailSectionHtml.trim());
+        renderSectionCounts();
     }
 
     function removeConsecutiveSectionHeaders() {
@@ -125,11 +144,18 @@ document.addEventListener("DOMContentLoaded", async () => {
         });
     }
 
-    async function appendCard(message) {
+    async function appendCard(message, sectionName, beforeCard = null) {
         const cardId = `${message.header_message_id}`;
         let emailCardHtml = cardTemplate.replace('{{id}}', cardId);
-        emailContainer.insertAdjacentHTML('beforeend', emailCardHtml.trim());
+        if (beforeCard) {
+            beforeCard.insertAdjacentHTML('beforebegin', emailCardHtml.trim());
+        } else {
+            emailContainer.insertAdjacentHTML('beforeend', emailCardHtml.trim());
+        }
         const card = document.getElementById(cardId);
+        card.dataset.section = sectionName;
+        card.dataset.date = message.date;
+        messagesById[cardId] = message;
 
         const hammertime = new Hammer(card);
 
@@ -226,47 +252,108 @@ document.addEventListener("DOMContentLoaded", async () => {
         }
     }
 
-    async function appendCardIfNeeded(message) {
+    async function appendCardIfNeeded(message, sectionName) {
         const cardId = `${message.header_message_id}`;
         const card = document.getElementById(cardId);
         if (card) {
+            messagesById[cardId] = message;
             await updateCard(message);
         } else {
-            await appendCard(message);
+            await appendCard(message, sectionName);
         }
     }
 
+    // Place a pushed message among the loaded cards of its section, newest first.
+    // Messages older than everything loaded so far arrive with the next page instead.
+    async function insertCard(message, sectionName) {
+        const sectionIndex = sections.findIndex(section => section.name === sectionName);
+        if (sectionIndex < 0 || sectionIndex > currentSectionIndex) {
+            return;
+        }
+        const cards = Array.from(emailContainer.querySelectorAll(`[id][data-section="${CSS.escape(sectionName)}"]`));
+        const beforeCard = cards.find(card => Number(card.dataset.date) < message.date);
+        if (beforeCard) {
+            await appendCard(message, sectionName, beforeCard);
+        } else if (sectionIndex < currentSectionIndex && cards.length) {
+            await appendCard(message, sectionName, cards[cards.length - 1].nextElementSibling);
+        }
+    }
+
+    // Tell the server which cards are on screen, so their summaries are generated first
+    let lastViewport = '';
+    function reportViewport() {
+        const visible = [];
+        for (const card of emailContainer.querySelectorAll('[id][data-section]')) {
+            const rect = card.getBoundingClientRect();
+            if (rect.bottom > 0 && rect.top < window.innerHeight) {
+                visible.push(card.id);
+            } else if (visible.length) {
+                break; // Cards are stacked, the rest is below the fold
+            }
+        }
+        const viewport = visible.join('\n');
+        if (viewport !== lastViewport) {
+            lastViewport = viewport;
+            socket.emit('viewport', { visible: visible });
+        }
+    }
+    window.addEventListener('scroll', throttle(async (reset) => reportViewport(), VIEWPORT_HINT_INTERVAL));
+    window.addEventListener('scrollend', reportViewport);
+    socket.on('connect', function() {
+        lastViewport = '';
+        reportViewport();
+    });
+
+    socket.on('messages-ingested', async function(data) {
+        for (const message of data.emails) {
+            if (document.getElementById(message.header_message_id)) {
+                await appendCardIfNeeded(message, data.section);
+            } else {
+                await insertCard(message, data.section);
+            }
+        }
+    });
+
+    socket.on('summary-ready', async function(data) {
+        const message = messagesById[data.header_message_id];
+        if (message) {
+            message.summary = data.summary;
+            await updateCard(message);
+        }
+    });
+
     async function loadEmails(tab, section) {
         if (reachedEnd) {
             return false;
         }
         // Construct the URL with query parameters for pagination
         let query = `/api/tabs/${tab}/sections/${section.name}/emails?limit=${PAGE_SIZE}`;
-        if (lastEmailDate) {
-            query += `&start_from=${encodeURIComponent(lastEmailDate)}`;
+        if (nextCursor) {
+            query += `&cursor=${encodeURIComponent(nextCursor)}`;
         }
 
         const emailResponse = await fetch(query);
-        const emails = await emailResponse.json();
-        const emailContainer = document.getElementById("emailContainer");
-        reachedEnd = emails.length < PAGE_SIZE;
-
-        if (emails.length > 0) {
-            // Update lastEmailDate with the date of the last email fetched
-            lastEmailDate = emails[emails.length - 1].date;
-        }
+        const page = await emailResponse.json();
+        const emails = page.emails;
+        nextCursor = page.next_cursor;
+        reachedEnd = !nextCursor;
 
         console.log(`Loaded emails.`, emails);
 
         emails.forEach(async (message, idx) => {
-            await appendCardIfNeeded(message);
+            await appendCardIfNeeded(message, section.name);
         });
+        reportViewport();
         return true;
     }
 
     async function loadSections(tab) {
         const sectionsResponse = await fetch(`/api/tabs/${tab}/sections`);
         sections = await sectionsResponse.json();
+        const countsResponse = await fetch(`/api/tabs/${tab}/counts`);
+        Object.assign(sectionCounts, await countsResponse.json());
+        subscription = { tab: tab, sections: sections.map(section => section.name) };
+        socket.emit('subscribe', subscription);
     }
 
     async function loadNext() {
@@ -283,7 +370,7 @@ document.addEventListener("DOMContentLoaded", async () => {
                     console.log(`Reached end of section ${section.name}.`);
                     currentSectionIndex++;
                     reachedEnd = false; // Reset reachedEnd for the next section
-                    lastEmailDate = null; // Reset lastEmailDate for the next section
+                    nextCursor = null; // Reset nextCursor for the next section
                     removeOrphanSectionHeaders();
                     appendSection(sections[currentSectionIndex]);
                     await innerLoadNext(); // Recursive call to load from the next section
@@ -322,4 +409,12 @@ const socket = io.connect('http://127.0.0.1:5000/');
 socket.on('connect', function() {
     console.log('Connected to the server');
     socket.emit('frontend-hello', 'Hello from frontend page!');
+    if (subscription) {
+        socket.emit('subscribe', subscription);
+    }
+});
+
+socket.on('section-counts', function(counts) {
+    Object.assign(sectionCounts, counts);
+    renderSectionCounts();
 });
@@ -1,47 +1,205 @@
-import requests
-import json
-from bs4 import BeautifulSoup
 import re
+import time
 
 from llm import llm
+import html_text
+import metrics
+import settings
+import summary_cache
 
 
 def html_to_text(html_content):
-    soup = BeautifulSoup(html_content, 'html.parser')
-    text = soup.get_text()
+    return html_text.html_to_text(html_content, settings.HTML_BACKEND)
 
-    # Replace sequences of whitespace characters with a single space or newline
-    def replacer(match):
-        # if the matched string contains a newline, replace with newline, otherwise replace with space
-        return '\n' if '\n' in match.group() else ' '
 
-    text = re.sub(r'[ \t\n]+', replacer, text)
+CHARS_PER_TOKEN = 4
 
-    return text.strip()  # Removing any trailing or leading whitespace
+# "On Mon, 1 Jan 2024 at 10:00, Someone <someone@example.com> wrote:" and Outlook style headers
+QUOTE_HEADER_RE = re.compile(
+    r'^(On\s.{0,200}?\swrote:|-{2,}\s*Original Message\s*-{2,}|From:\s.+\n(Sent|Date):\s.+)$',
+    re.MULTILINE | re.IGNORECASE)
+SIGNATURE_RE = re.compile(r'^(-- ?|Sent from my \w.*)$', re.MULTILINE)
+FOOTER_RE = re.compile(
+    r'unsubscribe|opt[ -]out|manage (your )?(email )?(preferences|subscriptions)|'
+    r'view (this email )?in (your )?browser|all rights reserved|privacy policy',
+    re.IGNORECASE)
+FOOTER_LINES = 12
+# A signature is a few lines at the end, not a separator followed by the rest of the mail
+SIGNATURE_LINES = 10
+# A reply or forward with less new text than this keeps its quoted part for context
+QUOTE_MIN_NEW_TOKENS = 64
+# Lines up to this long may sit between footer lines, e.g. an address or a copyright
+FOOTER_SHORT_LINE = 60
 
+prompt_stats = {'prompts': 0, 'trimmed': 0, 'bytes_removed': 0, 'tokens_removed': 0}
 
-def email_to_prompt(email):
+
+def estimate_tokens(text):
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def strip_quoted_replies(text):
+    """Drop '>' quoted lines and everything from the first reply header on.
+
+    A forward or a short answer is left alone, its quoted part is what the mail is about.
+    """
+    stripped = text
+    match = QUOTE_HEADER_RE.search(stripped)
+    if match:
+        stripped = stripped[:match.start()]
+    stripped = '\n'.join(line for line in stripped.split('\n') if not line.startswith('>'))
+    if estimate_tokens(stripped.strip()) < QUOTE_MIN_NEW_TOKENS:
+        return text
+    return stripped
+
+
+def strip_signature(text):
+    """Drop a signature of a few lines at the end, a block of half the message or more is kept."""
+    lines = text.rstrip().split('\n')
+    for idx in range(len(lines) - 1, max(len(lines) - SIGNATURE_LINES, 0) - 1, -1):
+        if SIGNATURE_RE.fullmatch(lines[idx]):
+            if '\n'.join(lines[:idx]).strip() and idx >= len(lines) - idx:
+                return '\n'.join(lines[:idx]) + '\n'
+            break
+    return text
+
+
+def strip_footer(text):
+    """Replace trailing boilerplate with a note, as offering to unsubscribe hints at commerce.
+
+    Only a contiguous block at the end is removed: footer lines together with the
+    blank and short lines between them, such as an address or a copyright. A
+    block making up half of the message or more is part of the body.
+    """
+    lines = text.rstrip().split('\n')
+    start = None
+    for idx in range(len(lines) - 1, max(len(lines) - FOOTER_LINES, 0) - 1, -1):
+        line = lines[idx].strip()
+        if FOOTER_RE.search(line):
+            start = idx
+        elif len(line) > FOOTER_SHORT_LINE:
+            break
+    if start is None or not '\n'.join(lines[:start]).strip() or start < len(lines) - start:
+        return text
+    mentions = sorted({match.group(0).lower() for line in lines[start:]
+                       for match in FOOTER_RE.finditer(line)})
+    return '\n'.join(lines[:start] + [f"[Footer removed, mentions: {', '.join(mentions)}]"])
+
+
+def truncate_head_tail(text, max_tokens, head_ratio):
+    """Keep the beginning and the end of a text that is over budget."""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    head_chars = int(max_chars * head_ratio)
+    tail_chars = max_chars - head_chars
+    head = text[:head_chars].rsplit(None, 1)[0] if head_chars else ''
+    tail = text[len(text) - tail_chars:].split(None, 1)[-1] if tail_chars else ''
+    omitted = len(text) - len(head) - len(tail)
+    return f"{head}\n[... {omitted} characters omitted ...]\n{tail}"
+
+
+def build_prompt(email, token_budget=None, head_ratio=None, body_text=None):
+    """Build the summarization prompt, keeping the body within a token budget.
+
+    Footers are always removed. A body over budget also loses its quoted reply
+    chain and signature, then it is cut down to its head and tail if it is still
+    over budget.
+
+    :param body_text: Already extracted text of the body, to avoid parsing it again
+
+    :return: tuple (prompt: str, report: dict with the removed bytes and tokens)
+    """
+    token_budget = settings.PROMPT_TOKEN_BUDGET if token_budget is None else token_budget
+    head_ratio = settings.PROMPT_HEAD_RATIO if head_ratio is None else head_ratio
     subject = email.get('header', {}).get('subject', '')
     author = email.get('header', {}).get('author', '')
-    body = html_to_text(email.get('body', ''))
-    return f"""
+    original = html_to_text(email.get('body', '')) if body_text is None else body_text
+    prompt_head = f"""
 Subject: {subject}
 Author: {author}
 
 EMAIL BODY BELOW THIS LINE
 
-{body}
 """
+    body_budget = max(token_budget - estimate_tokens(prompt_head), 0)
+    body = original
+    if estimate_tokens(body) > body_budget:
+        body = strip_signature(strip_quoted_replies(body))
+    body = strip_footer(body).strip()
+    body = truncate_head_tail(body, body_budget, head_ratio)
+    if len(body) > len(original):
+        # Nothing worth removing, the notes would only make it longer
+        body = original
+    bytes_removed = len(original.encode()) - len(body.encode())
+    report = {
+        'bytes_removed': bytes_removed,
+        'tokens_removed': estimate_tokens(original) - estimate_tokens(body),
+        'prompt_tokens': estimate_tokens(prompt_head) + estimate_tokens(body),
+    }
+    return f"{prompt_head}{body}\n", report
 
 
-def summarize(email):
+def email_to_prompt(email, body_text=None):
+    return build_prompt(email, body_text=body_text)[0]
+
+
+def record_prompt_report(report):
+    prompt_stats['prompts'] += 1
+    if report['bytes_removed']:
+        prompt_stats['trimmed'] += 1
+        prompt_stats['bytes_removed'] += report['bytes_removed']
+        prompt_stats['tokens_removed'] += report['tokens_removed']
+
+
+def get_prompt_stats():
+    return dict(prompt_stats)
+
+
+def prepare(email):
+    """CPU-bound part of summarizing: body text, prompt and cache key.
+
+    Takes and returns plain JSON data so it can run in a preprocessing process.
+    """
+    started = time.perf_counter()
+    body = html_to_text(email['body'])
+    parsed = time.perf_counter()
+    prompt, report = build_prompt(email, body_text=body)
+    # Timings travel with the result, the metrics of a preprocessing process are never served
+    report['parse_seconds'] = parsed - started
+    report['prompt_seconds'] = time.perf_counter() - parsed
+    return {
+        'body': body,
+        'prompt': prompt,
+        'report': report,
+        'key': summary_cache.cache_key(prompt),
+    }
+
+
+def summarize_prepared(prepared):
     threshold = 150
-    prompt = email_to_prompt(email)
-    result, reason = llm(prompt)
-    if not result:
-        return None, reason
+    body = prepared['body']
+    prompt = prepared['prompt']
+    report = prepared['report']
+    record_prompt_report(report)
+    metrics.PROMPT_TOKENS.observe(report['prompt_tokens'])
+    metrics.annotate(prompt_tokens=report['prompt_tokens'])
+    if 'parse_seconds' in report:
+        metrics.record_stage('html_parse', report['parse_seconds'])
+        metrics.record_stage('prompt_build', report['prompt_seconds'])
+    if report['bytes_removed']:
+        print(f"prompt: removed {report['bytes_removed']} bytes, "
+              f"~{report['tokens_removed']} tokens, ~{report['prompt_tokens']} tokens left")
+    key = prepared['key']
+    result = summary_cache.lookup(key)
+    metrics.annotate(summary_cache_hit=result is not None)
+    if result is None:
+        started = time.perf_counter()
+        result, reason = llm(prompt)
+        if not result:
+            return None, reason
+        summary_cache.store(key, result, time.perf_counter() - started)
     summary = result.get('summary', '')
-    body = html_to_text(email['body'])
     if len(body) <= threshold:
         result['summary'] = body
         result['is_full_message'] = True
@@ -49,3 +207,7 @@ def summarize(email):
         result['summary'] = body[:threshold]
         result['is_uprocessed_summary'] = True
     return result, "Success"
+
+
+def summarize(email):
+    return summarize_prepared(prepare(email))
@@ -0,0 +1,85 @@
+import hashlib
+import json
+import re
+import time
+
+import database
+import settings
+
+# Changes whenever the field_checks schema in config.yaml changes
+SCHEMA_VERSION = hashlib.sha256(json.dumps(
+    settings.FIELD_CHECKS, sort_keys=True).encode()).hexdigest()[:16]
+
+stats = {'hits': 0, 'misses': 0, 'generation_seconds_saved': 0.0}
+
+
+def normalize_prompt(prompt):
+    return re.sub(r'\s+', ' ', prompt).strip()
+
+
+def cache_key(prompt):
+    """Hash of the normalized prompt, the model and the field_checks schema version."""
+    material = '\0'.join(
+        [settings.MODEL_NAME, SCHEMA_VERSION, normalize_prompt(prompt)])
+    return hashlib.sha256(material.encode()).hexdigest()
+
+
+def lookup(key):
+    """Return the cached LLM result for the key, or None on a miss."""
+    entry = database.SummaryCacheEntry.query.filter_by(key=key).first()
+    if not entry:
+        stats['misses'] += 1
+        return None
+    entry.hits += 1
+    entry.last_used_at = time.time()
+    database.db.session.commit()
+    stats['hits'] += 1
+    stats['generation_seconds_saved'] += entry.generation_seconds
+    return json.loads(entry.result)
+
+
+def store(key, result, generation_seconds):
+    now = time.time()
+    status, message, entry = database.add_unique_item_to_db(
+        database.SummaryCacheEntry, ['key'], key=key, result=json.dumps(result),
+        generation_seconds=generation_seconds, created_at=now, last_used_at=now)
+    if not status:
+        print(f"Failed to cache summary: {message}")
+        return
+    evict(settings.SUMMARY_CACHE_SIZE)
+
+
+def evict(max_entries):
+    """Drop least recently used entries beyond max_entries."""
+    excess = database.SummaryCacheEntry.query.count() - max_entries
+    if excess <= 0:
+        return
+    stale_ids = (database.db.session.query(database.SummaryCacheEntry.id)
+                 .order_by(database.SummaryCacheEntry.last_used_at)
+                 .limit(excess)
+                 .subquery())
+    (database.SummaryCacheEntry.query
+     .filter(database.SummaryCacheEntry.id.in_(stale_ids.select()))
+     .delete(synchronize_session=False))
+    database.db.session.commit()
+
+
+def get_stats():
+    """Counters of this process plus totals persisted across restarts."""
+    entries, total_hits, total_saved = database.db.session.query(
+        database.db.func.count(database.SummaryCacheEntry.id),
+        database.db.func.coalesce(database.db.func.sum(database.SummaryCacheEntry.hits), 0),
+        database.db.func.coalesce(database.db.func.sum(
+            database.SummaryCacheEntry.hits * database.SummaryCacheEntry.generation_seconds), 0.0),
+    ).one()
+    lookups = stats['hits'] + stats['misses']
+    return {
+        'entries': entries,
+        'max_entries': settings.SUMMARY_CACHE_SIZE,
+        'hits': stats['hits'],
+        'misses': stats['misses'],
+        'hit_rate': stats['hits'] / lookups if lookups else 0.0,
+        'generation_seconds_saved': stats['generation_seconds_saved'],
+        'total_hits': total_hits,
+        'total_generation_seconds_saved': total_saved,
+    }
@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+from flask import Flask
+
+# settings reads config.yaml from the working directory at import time
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(ROOT)
+sys.path.insert(0, ROOT)
+
+import database  # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'test.db'}"
+    database.init_app(app)
+    with app.app_context():
+        yield app
+        database.db.session.remove()
+        database.membership_conditions.clear()
+        database.db.engine.dispose()
@@ -0,0 +1,47 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+
+import database
+from benchmarks.ingest import make_messages
+
+
+def add_summary(message_id, summary):
+    database.db.session.add(database.MessageSummary(
+        message_id=message_id, summary=summary, isWork=0.1, isCommerce=0.2, isSpam=0.0))
+    database.db.session.commit()
+
+
+def test_a_message_has_one_summary(app):
+    database.Message.bulk_create_and_add_to_db(make_messages(1))
+    add_summary(1, 'first')
+    with pytest.raises(IntegrityError):
+        add_summary(1, 'second')
+
+
+def test_schema_update_keeps_the_latest_of_duplicate_summaries(app):
+    database.Message.bulk_create_and_add_to_db(make_messages(2))
+    # An older database: non-unique index and several summaries for a message
+    database.db.session.execute(text('DROP INDEX unique_message_summary_message'))
+    database.db.session.execute(text(
+        'CREATE INDEX index_message_summary_message ON message_summary (message_id)'))
+    for message_id, summary in ((1, 'old'), (2, 'only'), (1, 'new')):
+        add_summary(message_id, summary)
+
+    database.create_schema()
+    assert sorted(database.db.session.execute(text(
+        'SELECT message_id, summary FROM message_summary')).all()) == [(1, 'new'), (2, 'only')]
+    indexes = {name for (name,) in database.db.session.execute(text(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'message_summary'"))}
+    assert 'unique_message_summary_message' in indexes
+    assert 'index_message_summary_message' not in indexes
+
+
+def test_schema_update_drops_retired_indexes(app):
+    database.db.session.execute(text('CREATE INDEX index_date_id ON message (date, id)'))
+    database.db.session.commit()
+
+    database.create_schema()
+    indexes = {name for (name,) in database.db.session.execute(text(
+        "SELECT name FROM sqlite_master WHERE type = 'index'"))}
+    assert not indexes & set(database.RETIRED_INDEXES)
@@ -0,0 +1,41 @@
+from sqlalchemy import text
+
+import database
+from benchmarks.ingest import make_messages
+
+
+def test_resync_reports_only_new_or_changed_messages(app):
+    messages = make_messages(3)
+    results, changed = database.Message.bulk_create_and_add_to_db(messages)
+    assert all(status for status, _ in results)
+    assert changed == [data['headerMessageId'] for data in messages]
+    version = database.DataVersion.current()
+
+    results, changed = database.Message.bulk_create_and_add_to_db(messages)
+    assert all(status for status, _ in results)
+    assert changed == []
+    assert database.DataVersion.current() == version
+
+    messages[1]['read'] = not messages[1].get('read', False)
+    extra = make_messages(4)[3]
+    _, changed = database.Message.bulk_create_and_add_to_db(messages + [extra])
+    assert changed == [messages[1]['headerMessageId'], extra['headerMessageId']]
+    assert database.Message.query.count() == 4
+
+
+def test_ingest_survives_a_broken_search_index(app):
+    database.Message.bulk_create_and_add_to_db(make_messages(1))
+    assert database.search_index_available
+    database.db.session.execute(text('DROP TABLE message_search'))
+    database.db.session.commit()
+
+    results, changed = database.Message.bulk_create_and_add_to_db(make_messages(2))
+    assert all(status for status, _ in results)
+    assert len(changed) == 1
+    assert database.Message.query.count() == 2
+    assert not database.search_index_available
+
+    # The next start rebuilds the index it could not keep up to date
+    database.create_search_index()
+    assert database.search_index_available
+    assert database.db.session.execute(text('SELECT count(*) FROM message_search')).scalar() == 2
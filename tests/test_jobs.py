@@ -0,0 +1,41 @@
+import database
+
+
+def job_state(header_message_id):
+    job = database.SummaryJob.query.filter_by(header_message_id=header_message_id).one()
+    database.db.session.refresh(job)
+    return job.state, job.attempts
+
+
+def fail(header_message_id):
+    database.SummaryJob.query.filter_by(header_message_id=header_message_id).update(
+        {'state': database.SummaryJob.FAILED, 'attempts': 3})
+    database.db.session.commit()
+
+
+def test_background_enqueues_leave_failed_jobs_alone(app):
+    database.SummaryJob.enqueue_many({'a@example.com': 1, 'b@example.com': 1})
+    fail('a@example.com')
+
+    database.SummaryJob.enqueue_many({'a@example.com': 5, 'b@example.com': 5})
+    assert job_state('a@example.com') == (database.SummaryJob.FAILED, 3)
+    assert job_state('b@example.com') == (database.SummaryJob.PENDING, 0)
+
+
+def test_explicit_enqueue_retries_a_failed_job(app):
+    database.SummaryJob.enqueue('a@example.com', 1)
+    fail('a@example.com')
+
+    database.SummaryJob.enqueue('a@example.com', 1000000)
+    assert job_state('a@example.com') == (database.SummaryJob.PENDING, 0)
+
+
+def test_waiting_does_not_outrank_newer_mail_within_hours(app):
+    # A job enqueued 20 minutes ago for mail two days older than a new one
+    database.SummaryJob.enqueue_many({'old@example.com': 700, 'new@example.com': 720})
+    database.SummaryJob.query.filter_by(header_message_id='old@example.com').update(
+        {'enqueued_at': database.SummaryJob.enqueued_at - 20 * 60})
+    database.db.session.commit()
+
+    assert database.SummaryJob.upcoming(2, aging_per_hour=1.0) == ['new@example.com', 'old@example.com']
+    assert database.SummaryJob.claim_next(aging_per_hour=1.0).header_message_id == 'new@example.com'
@@ -0,0 +1,30 @@
+import database
+from benchmarks.ingest import make_messages
+from benchmarks.listing_queries import QueryCounter
+from sections import SectionRegistry
+
+
+def test_section_page_queries_do_not_grow_with_the_messages(app):
+    registry = SectionRegistry([{'name': 'all'}], [{'name': 'general', 'sections': ['all']}])
+    registry.sync()
+    counter = QueryCounter(database.db.engine)
+
+    queries = {}
+    summarized = 0
+    for count in (4, 40, 100):
+        database.Message.bulk_create_and_add_to_db(make_messages(count))
+        for message_id in range(summarized + 1, count + 1):
+            database.db.session.add(database.MessageSummary(
+                message_id=message_id, summary=f"Summary {message_id}", isWork=0.1, isCommerce=0.2, isSpam=0.0))
+            database.db.session.add(database.Tag(message_id=message_id, tag='$label1'))
+        database.db.session.commit()
+        summarized = count
+
+        database.db.session.expunge_all()
+        counter.count = 0
+        # The page get_emails_by_section serves
+        page, _ = registry.sections['all'].page(100)
+        assert len(page) == count
+        assert all(message['summary'] and message['tags'] for message in page)
+        queries[count] = counter.count
+    assert len(set(queries.values())) == 1, queries
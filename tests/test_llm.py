@@ -0,0 +1,73 @@
+import eventlet
+import pytest
+
+import llm
+import settings
+
+SCHEMA = {'type': 'object', 'properties': {'summary': {'type': 'string'}}}
+
+
+class FakeResponse:
+    def __init__(self, status_code, text=''):
+        self.status_code = status_code
+        self.text = text
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def ollama(monkeypatch):
+    """Answers generations with the queued `responses`, recording the `formats` sent."""
+    class Ollama:
+        responses = []
+        formats = []
+
+        @classmethod
+        def post(cls, url, json, stream):
+            cls.formats.append(json.get('format'))
+            return cls.responses.pop(0)
+
+    monkeypatch.setattr(llm.requests, 'post', Ollama.post)
+    monkeypatch.setattr(settings, 'OLLAMA_FORMAT', 'schema')
+    monkeypatch.setattr(llm, 'schema_format_supported', True)
+    return Ollama
+
+
+def test_falls_back_to_json_when_the_schema_is_rejected(ollama):
+    ollama.responses = [FakeResponse(400, '{"error": "invalid format: json schema not supported"}'),
+                        FakeResponse(200)]
+    response = llm.post_generate('model', 'prompt', SCHEMA, stream=False)
+    assert response.status_code == 200
+    assert ollama.formats == [SCHEMA, 'json']
+    assert llm.schema_format_supported is False
+
+
+@pytest.mark.parametrize('status_code, text', [
+    (500, 'format broke the runner'), (400, 'model "llama" not found'), (503, 'server busy')])
+def test_other_errors_keep_the_schema_format(ollama, status_code, text):
+    ollama.responses = [FakeResponse(status_code, text)]
+    response = llm.post_generate('model', 'prompt', SCHEMA, stream=False)
+    assert response.status_code == status_code
+    assert ollama.formats == [SCHEMA]
+    assert llm.schema_format_supported is True
+
+
+def test_a_freed_generation_slot_goes_to_the_most_urgent_waiter():
+    slots = llm.PrioritySlots(1)
+    slots.acquire()
+    served = []
+
+    def wait(name, priority):
+        slots.acquire(priority)
+        served.append(name)
+        slots.release()
+
+    waiters = [eventlet.spawn(wait, name, priority) for name, priority in
+               (('background 1', 10), ('background 2', 20), ('interactive', 1000000), ('background 3', 10))]
+    eventlet.sleep(0)
+    slots.release()
+    for waiter in waiters:
+        waiter.wait()
+    assert served == ['interactive', 'background 2', 'background 1', 'background 3']
+    assert slots.free == 1
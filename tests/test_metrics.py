@@ -0,0 +1,21 @@
+from sqlalchemy import create_engine, text
+
+import database
+import metrics
+
+
+def queries_of(scope):
+    return metrics.SQL_QUERIES.series.get((scope,), 0)
+
+
+def test_queries_are_counted_on_the_app_engine_only(app):
+    before = queries_of('other')
+    database.db.session.execute(text('SELECT 1'))
+    assert queries_of('other') == before + 1
+
+    # Engines of other apps or scripts are not the app's queries
+    engine = create_engine('sqlite://')
+    with engine.connect() as connection:
+        connection.execute(text('SELECT 1'))
+    engine.dispose()
+    assert queries_of('other') == before + 1
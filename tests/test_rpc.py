@@ -0,0 +1,42 @@
+import eventlet
+
+from rpc import RpcPool
+
+
+class FakeClients:
+    """Emit function keeping the ack callbacks, so tests decide when clients answer."""
+
+    def __init__(self):
+        self.callbacks = []
+
+    def __call__(self, event, message, sid, callback):
+        self.callbacks.append(callback)
+
+
+def start_call(pool):
+    call = eventlet.spawn(pool.call, 'ping', {}, 1)
+    eventlet.sleep(0)
+    return call
+
+
+def test_late_ack_after_disconnect_is_dropped():
+    clients = FakeClients()
+    pool = RpcPool(clients)
+    pool.add('a')
+    call = start_call(pool)
+    pool.remove('a')
+    clients.callbacks[0]('pong')
+    response, reason = call.wait()
+    assert response is None
+    assert 'disconnected' in reason
+
+
+def test_disconnect_after_ack_keeps_the_answer():
+    clients = FakeClients()
+    pool = RpcPool(clients)
+    pool.add('a')
+    call = start_call(pool)
+    clients.callbacks[0]('pong')
+    pool.remove('a')
+    clients.callbacks[0]('pong again')
+    assert call.wait() == ('pong', "Success")
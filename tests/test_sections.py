@@ -0,0 +1,64 @@
+import database
+from benchmarks.ingest import make_messages
+from sections import SectionRegistry
+
+SECTIONS = [
+    {'name': 'bob', 'filters': [{'type': 'sender_name_contains', 'value': 'bob'}]},
+    {'name': 'not_bob', 'exclude': ['bob']},
+    {'name': 'no_newsletter', 'exclude': ['newsletter']},
+    {'name': 'newsletter', 'filters': [{'type': 'subject_contains', 'value': 'newsletter'}]},
+    {'name': 'example', 'filters': [{'type': 'sender_domain', 'value': 'example.com'}]},
+]
+TABS = [{'name': 'general', 'sections': [section['name'] for section in SECTIONS]}]
+
+
+def message(i, author, subject=None):
+    data = make_messages(i + 1)[i]
+    data['author'] = author
+    data['subject'] = subject
+    return data
+
+
+def memberships():
+    return {(section, header_message_id) for section, header_message_id in database.db.session.query(
+        database.SectionMembership.section, database.Message.header_message_id)
+        .join(database.Message, database.Message.id == database.SectionMembership.message_id)}
+
+
+def test_null_columns_match_the_same_on_rebuild_and_ingest(app):
+    # Bare addresses have no author name, and the subject may be missing too
+    before = [message(0, 'plain@example.com'), message(1, '"Bob" <bob@example.com>', 'Newsletter')]
+    after = [message(2, 'plain@example.com'), message(3, '"Bob" <bob@example.com>', 'Newsletter')]
+    database.Message.bulk_create_and_add_to_db(before)
+    registry = SectionRegistry(SECTIONS, TABS)
+    registry.sync()
+    database.Message.bulk_create_and_add_to_db(after)
+
+    rows = memberships()
+    for rebuilt, ingested in zip(before, after):
+        rebuilt_sections = {section for section, header in rows if header == rebuilt['headerMessageId']}
+        ingested_sections = {section for section, header in rows if header == ingested['headerMessageId']}
+        assert rebuilt_sections == ingested_sections
+    assert {section for section, header in rows if header == before[0]['headerMessageId']} == \
+        {'not_bob', 'no_newsletter', 'example'}
+
+    # Counters kept up on ingest agree with a full rebuild
+    counts = database.section_counts()
+    database.SectionState.query.delete()
+    SectionRegistry(SECTIONS, TABS).sync()
+    assert database.section_counts() == counts
+    assert memberships() == rows
+
+
+def test_sender_domain_matches_the_exact_domain_only(app):
+    database.Message.bulk_create_and_add_to_db([
+        message(0, 'a@example.com'), message(1, 'b@mail.example.com'),
+        message(2, 'c@notexample.com'), message(3, 'd@EXAMPLE.com')])
+    registry = SectionRegistry(SECTIONS, TABS)
+    registry.sync()
+    section = registry.sections['example']
+    expected = {'bench-0@example.com', 'bench-3@example.com'}
+    for condition in (section.condition, section.match_condition):
+        matched = {header for (header,) in database.db.session.query(
+            database.Message.header_message_id).filter(condition)}
+        assert matched == expected
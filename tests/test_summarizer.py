@@ -0,0 +1,64 @@
+from summarizer import build_prompt, strip_footer, strip_quoted_replies, strip_signature
+
+BODY = '\n'.join(f"Paragraph {i} of the newsletter with enough words to be real content here." for i in range(10))
+
+
+def test_trailing_footer_block_is_removed():
+    text = BODY + "\n\nYou received this email because you signed up.\nUnsubscribe | Privacy policy\n" \
+                  "Example Inc, 1 Main St\n© 2024 All rights reserved"
+    stripped = strip_footer(text)
+    assert stripped.startswith(BODY)
+    assert 'Main St' not in stripped
+    assert stripped.endswith("[Footer removed, mentions: all rights reserved, privacy policy, unsubscribe]")
+
+
+def test_footer_mention_followed_by_content_is_kept():
+    text = BODY + "\nIf you unsubscribe you will miss our sale, which starts on Monday and ends on Friday.\n" \
+                  "The full schedule of the sale is in the attachment, please read it carefully before."
+    assert strip_footer(text) == text
+
+
+def test_short_body_discussing_unsubscribing_is_kept():
+    text = "Hi,\nI tried to unsubscribe from the list but still get mails.\nThanks"
+    assert strip_footer(text) == text
+
+
+def test_short_transactional_mail_is_kept():
+    text = "Your order #123 has shipped.\nManage preferences to opt out of shipping updates.\n" \
+           "Items: 2x socks, total $12"
+    assert strip_footer(text) == text
+
+
+def test_short_body_with_footer_line_at_the_end():
+    text = "Your order #123 has shipped and will arrive on Tuesday.\n" \
+           "The courier will call you an hour before delivery.\n" \
+           "Reply to this mail if you need to change the address.\nPrivacy policy"
+    assert strip_footer(text) == '\n'.join(text.split('\n')[:3] + ["[Footer removed, mentions: privacy policy]"])
+
+
+def test_separator_followed_by_the_mail_is_not_a_signature():
+    text = "Hi team\n--\n" + BODY + "\n" + BODY
+    assert strip_signature(text) == text
+    prompt, report = build_prompt({'body': text}, body_text=text)
+    assert report['bytes_removed'] == 0
+
+
+def test_short_signature_is_removed_from_a_long_mail():
+    text = BODY + "\n-- \nAlice\nExample Inc"
+    assert strip_signature(text) == BODY + "\n"
+
+
+def test_forward_keeps_the_forwarded_text():
+    text = "FYI, see below\n\nFrom: Alice <alice@example.com>\nSent: Monday, 1 January 2024 10:00\n" \
+           "Subject: Roadmap\n\n" + BODY
+    assert strip_quoted_replies(text) == text
+    prompt, report = build_prompt({'body': text}, token_budget=64, body_text=text)
+    assert 'Paragraph 0' in prompt
+
+
+def test_quotes_are_kept_while_the_mail_fits_the_budget():
+    text = BODY + "\n\nOn Mon, 1 Jan 2024 at 10:00, Alice <alice@example.com> wrote:\n> Earlier mail"
+    prompt, report = build_prompt({'body': text}, body_text=text)
+    assert report['bytes_removed'] == 0
+    prompt, report = build_prompt({'body': text}, token_budget=200, body_text=text)
+    assert 'Earlier mail' not in prompt and 'Paragraph 9' in prompt
@@ -61,12 +61,20 @@ async function postMessages(messages) {
         if (response.ok) {
             console.log(`Successfully added messages (HTTP Status: ${response.status}):`, responseData);
             return responseData;
+        } else if (response.status === 400 && Array.isArray(responseData.details) && responseData.details.length) {
+            // The rest of the page was stored, invalid messages would fail the same way on every retry
+            for (const failure of responseData.details) {
+                console.warn(`Server rejected message ${failure.headerMessageId}: ${failure.message}`);
+            }
+            return responseData;
         } else {
             console.error(`Error adding messages (HTTP Status: ${response.status}):`, responseData);
             throw new Error(responseData.message || "Unknown error");
         }
     } catch (error) {
         console.error("Failed to post messages:", error);
+        // Network, server and parse errors: a sync must not be checkpointed past a page the server never stored
+        throw error;
     }
 }
 
@@ -79,41 +87,121 @@ socket.on('connect', function() {
     socket.emit('thunderbridge-hello', 'Hello from Thunderbird plugin!');
 });
 
+function* walkFolders(folders) {
+    for (const folder of folders) {
+        yield folder;
+        if (folder.subFolders) {
+            yield* walkFolders(folder.subFolders);
+        }
+    }
+}
+
+// Posts a message list page by page, returns the newest message date in ms.
+// Throws on the first page that fails, leaving the rest for the next sync
+async function postPages(page) {
+    let latestDate = 0;
+    while (true) {
+        if (page.messages.length) {
+            console.log(`sending page:`, page);
+            await postMessages(page);
+            for (const message of page.messages) {
+                latestDate = Math.max(latestDate, new Date(message.date).getTime());
+            }
+        }
+        if (!page.id) {
+            return latestDate;
+        }
+        page = await messenger.messages.continueList(page.id);
+    }
+}
+
+// Only messages since the checkpoint minus the overlap, or everything on the first sync
+async function syncFolder(folder, checkpoint, overlapSeconds) {
+    let page;
+    if (checkpoint && checkpoint.latest_date) {
+        const fromDate = new Date((checkpoint.latest_date - overlapSeconds) * 1000);
+        page = await messenger.messages.query({ "folder": folder, "fromDate": fromDate });
+    } else {
+        page = await messenger.messages.list(folder);
+    }
+    // A failed page throws before folder-synced, so the checkpoint stays where it was
+    const latestDate = await postPages(page);
+    // The server moves the checkpoint only once the whole folder got through
+    socket.emit('folder-synced', {
+        "folder": { "accountId": folder.accountId, "path": folder.path, "name": folder.name, "type": folder.type },
+        "latest_date": latestDate ? Math.floor(latestDate / 1000) : null,
+    });
+}
+
 socket.on('fetch-emails', async function(data) {
-    console.log(`fetch-emails: ${data}`);
+    console.log(`fetch-emails:`, data);
+    const checkpoints = {};
+    for (const checkpoint of data.checkpoints || []) {
+        checkpoints[`${checkpoint.accountId}:${checkpoint.path}`] = checkpoint;
+    }
     let accounts = await messenger.accounts.list(true);
-    let folders = accounts[0].folders;
-    let folder = folders[0];
-    let folderInfo = await messenger.folders.getFolderInfo(folder);
-    let startAt = 0;
+    for (const account of accounts) {
+        for (const folder of walkFolders(account.folders)) {
+            try {
+                await syncFolder(folder, checkpoints[`${folder.accountId}:${folder.path}`], data.overlap_seconds || 0);
+            } catch (error) {
+                console.error(`Failed to sync ${folder.accountId}:${folder.path}:`, error);
+            }
+        }
+    }
+});
 
-    let page = await messenger.messages.list(folder);
-    page.startAt = startAt;
-    page.total = folderInfo.totalMessageCount;
-    console.log(`sending page:`, page);
-    startAt += page.messages.length;
-    await postMessages(page);
+// Keep the server current between syncs
+messenger.messages.onNewMailReceived.addListener(async (folder, messages) => {
+    try {
+        await postPages(messages);
+    } catch (error) {
+        console.error(`Failed to post new mail of ${folder.accountId}:${folder.path}:`, error);
+    }
+});
 
-    while (page.id) {
-        page = await messenger.messages.continueList(page.id);
-        page.startAt = startAt;
-        page.total = folderInfo.totalMessageCount;
-        console.log(`sending page:`, page);
-        startAt += page.messages.length;
-        await postMessages(page);
+messenger.messages.onUpdated.addListener(async (message, changedProperties) => {
+    try {
+        await postMessages({ "messages": [message] });
+    } catch (error) {
+        console.error(`Failed to post update of ${message.headerMessageId}:`, error);
     }
 });
 
-socket.on('request_email_body', async (data, callback) => {
-    console.log(`request_email_body:`, data);
-    let messages = await messenger.messages.query({"headerMessageId" : data['header_message_id']});
+async function getEmailBody(headerMessageId) {
+    let messages = await messenger.messages.query({"headerMessageId" : headerMessageId});
     let message = messages.messages[0];
+    if (!message) {
+        return null;
+    }
     var messageFull = await messenger.messages.getFull(message.id);
-    const messageBody = getPlainTextFromBody(messageFull.parts);
+    return getPlainTextFromBody(messageFull.parts);
+}
+
+socket.on('request_email_body', async (data, callback) => {
+    console.log(`request_email_body:`, data);
+    const messageBody = await getEmailBody(data['header_message_id']);
     console.log(`body:`, messageBody);
     callback(messageBody);
 });
 
+// Answers with {headerMessageId: body}, messages that can't be read are left out
+socket.on('request_email_bodies', async (data, callback) => {
+    console.log(`request_email_bodies:`, data);
+    const bodies = {};
+    await Promise.all(data['header_message_ids'].map(async (headerMessageId) => {
+        try {
+            const messageBody = await getEmailBody(headerMessageId);
+            if (messageBody) {
+                bodies[headerMessageId] = messageBody;
+            }
+        } catch (error) {
+            console.error(`Failed to read body of ${headerMessageId}:`, error);
+        }
+    }));
+    callback(bodies);
+});
+
 socket.on('open-email', async function(data) {
     console.log(`open-email:`, data);
     let messages = await messenger.messages.query({"headerMessageId" : data['header_message_id']});
@@ -0,0 +1,64 @@
+import eventlet
+import eventlet.event
+import eventlet.semaphore
+
+
+class WorkerPool:
+    """Runs jobs on up to `size` green threads.
+
+    A job is claimed only once a slot is free, so pending work stays in its
+    store instead of piling up in memory while the workers are busy.
+    """
+
+    def __init__(self, size, claim, handle, poll_interval=5):
+        """
+        :param size: Maximum number of jobs handled concurrently
+        :param claim: Callable returning the next job, or None when there is nothing to do
+        :param handle: Callable processing one claimed job
+        :param poll_interval: Seconds to sleep when idle before claiming again without a notify
+        """
+        self.size = size
+        self.claim = claim
+        self.handle = handle
+        self.poll_interval = poll_interval
+        self.slots = eventlet.semaphore.Semaphore(size)
+        self.jobs_available = eventlet.event.Event()
+
+    def notify(self):
+        """Wake up an idle pool after new jobs were added."""
+        if not self.jobs_available.ready():
+            self.jobs_available.send()
+
+    def in_flight(self):
+        return self.size - self.slots.balance
+
+    def _wait_for_jobs(self):
+        self.jobs_available.wait(self.poll_interval)
+        if self.jobs_available.ready():
+            self.jobs_available.reset()
+
+    def _run(self, job):
+        try:
+            self.handle(job)
+        except Exception as e:
+            print(f"Worker failed to process job {job}: {e}")
+        finally:
+            self.slots.release()
+
+    def run(self, stop_when_idle=False):
+        """Claim and dispatch jobs forever, or until the store runs dry if `stop_when_idle`."""
+        while True:
+            self.slots.acquire()
+            job = self.claim()
+            if job is None:
+                self.slots.release()
+                if stop_when_idle:
+                    break
+                self._wait_for_jobs()
+                continue
+            eventlet.spawn_n(self._run, job)
+        # Wait for the jobs still in flight
+        for _ in range(self.size):
+            self.slots.acquire()
+        for _ in range(self.size):
+            self.slots.release()